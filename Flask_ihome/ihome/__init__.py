@@ -12,8 +12,8 @@ from logging.handlers import RotatingFileHandler
 
 # 创建数据库对象
 db = SQLAlchemy()
-# 创建redis对象
-redis_store = redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT)
+# 创建redis对象，create_app时按app的配置重新设置连接的库
+redis_store = redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=Config.REDIS_DB)
 
 # 使用wtf提供的csrf保护机制
 csrf = CSRFProtect()
@@ -41,6 +41,10 @@ def create_app(config_name):
 
     # 数据库处理
     db.init_app(app)
+    # 其他模块导入的是同一个redis对象，替换连接池使其连接到app配置的库
+    redis_store.connection_pool = redis.ConnectionPool(host=app.config["REDIS_HOST"],
+                                                       port=app.config["REDIS_PORT"],
+                                                       db=app.config["REDIS_DB"])
     # 为app添加CSRF保护
     csrf.init_app(app)
 
@@ -55,4 +59,9 @@ def create_app(config_name):
     from .web_page import html as html_blueprint
     app.register_blueprint(html_blueprint)
 
+    # 应用启动时在后台预热缓存
+    if app.config.get("CACHE_WARMUP_ON_STARTUP"):
+        from ihome.utils import warmup
+        warmup.start_background_warmup(app)
+
     return app
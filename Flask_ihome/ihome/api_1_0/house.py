@@ -14,8 +14,24 @@ from ihome.models import Area, House, Facility, HouseImage, User, Order
 from ihome.utils.image_storage import storage
 # 导入常量配置信息
 from ihome import constants, db
-# 导入用户验证装饰器
-from ihome.utils.commons import login_required
+# 导入用户验证装饰器和缓存响应
+from ihome.utils.commons import login_required, make_cached_response
+# 导入房屋预订位图
+from ihome.utils import availability
+# 导入游标分页工具
+from ihome.utils import pagination
+# 导入房屋列表有序集合
+from ihome.utils import house_rank
+# 导入缓存重建工具
+from ihome.utils import cache
+# 导入房屋总数缓存
+from ihome.utils import house_count
+# 导入房屋列表页缓存键的记录
+from ihome.utils import house_list_keys
+# 导入房屋价格日历
+from ihome.utils import price_calendar
+# 导入字段加载选项
+from sqlalchemy.orm import load_only
 # 导入时间模块
 import datetime
 
@@ -28,52 +44,42 @@ import json
 def get_areas_info():
     """
     获取城区参数，缓存--数据库---缓存
-    1.读取缓存中的城区信息
-    2.校验获取的结果，如果有直接返回
-    3.如果没有，查询数据库中的城区数据
-    4.校验查询结果
-    5.定义容器存储查询结果
-    6.遍历查询结果，需要调用模型类中的to_dict()方法
-    7.把城区信息序列化
-    8.把城区数据缓存到redis中
-    9.返回结果
+    1.读取缓存中的城区信息，如果有直接返回，缓存超过软过期时间时返回旧数据并在后台刷新
+    2.如果没有，抢到重建锁的请求查询数据库中的城区数据，其他请求等待缓存重建
+    3.校验查询结果
+    4.定义容器存储查询结果
+    5.遍历查询结果，需要调用模型类中的to_dict()方法
+    6.把城区信息序列化
+    7.把城区数据缓存到redis中，同时缓存数据摘要和gzip压缩后的数据
+    8.返回结果，支持If-None-Match和gzip压缩
     :return:
     """
-    # 从缓存中获取城区信息
-    try:
-        areas = redis_store.get("area_info")
-    except Exception as e:
-        current_app.logger.error(e)
-        areas = None
-    # 判断获取结果
-    if areas:
-        # 记录访问redis的历史
-        current_app.logger.info("hit redis area info")
-        resp =  '{"errno":0,"errmsg":"OK","data":%s}' % areas
-        return resp
-    # 如果缓存中没有数据，读取mysql中的数据
-    try:
+    def rebuild():
+        # 如果缓存中没有数据，读取mysql中的数据
         areas = Area.query.all()
+        # 判断查询结果
+        if not areas:
+            return None
+        # 定义容器,存储查询结果
+        areas_list = list()
+        # 遍历查询结果集
+        for area in areas:
+            areas_list.append(area.to_dict())
+        # 序列化城区信息，缓存完整的响应报文
+        return '{"errno":0,"errmsg":"OK","data":%s}' % json.dumps(areas_list)
+
+    # 从缓存中获取城区信息，缓存失效时只有一个请求查询数据库
+    try:
+        resp = cache.get_or_rebuild(constants.AREA_INFO_REDIS_KEY, rebuild, constants.AREA_INFO_REDIS_EXPIRES,
+                                    serve_stale=True, local=True, compress=True)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg="查询数据库异常")
     # 判断查询结果
-    if not areas:
+    if resp is None:
         return jsonify(errno=RET.NODATA,errmsg="无城区信息")
-    # 定义容器,存储查询结果
-    areas_list = list()
-    # 遍历查询结果集
-    for area in areas:
-        areas_list.append(area.to_dict())
-    # 序列化城区信息
-    areas_json = json.dumps(areas_list)
-    # 缓存城区信息数据
-    try:
-        redis_store.setex("area_info",constants.AREA_INFO_REDIS_EXPIRES,areas_json)
-    except Exception as e:
-        current_app.logger.error(e)
-    # 返回数据
-    return '{"errno":0,"errmsg":"OK","data":%s}' % areas_json
+    # 返回数据，客户端数据未变化时返回304，支持gzip时直接返回压缩好的数据
+    return make_cached_response(resp)
 
 
 # 发布新房源模块
@@ -159,6 +165,12 @@ def save_house_info():
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="存储房屋信息失败")
+    # 将新房源加入房屋列表页的有序集合，并删除所在区域的房屋总数缓存
+    try:
+        house_rank.add_house(house)
+        house_count.invalidate_houses_count(house.area_id)
+    except Exception as e:
+        current_app.logger.error(e)
     # 返回结果 返回的house_id是给后面上传房屋图片,和房屋进行关联
     return jsonify(errno=RET.OK,errmsg="OK",data={'house_id':house.id})
 
@@ -224,6 +236,13 @@ def save_house_image(house_id):
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="保存图片数据失败")
+    # 房屋主图片变化后，删除房屋列表页中该房屋的基本信息片段，并将房屋加入首页幻灯片的有序集合
+    if house.index_image_url == image_name:
+        try:
+            house_rank.delete_fragment(house_id)
+            house_rank.add_house(house)
+        except Exception as e:
+            current_app.logger.error(e)
     # 拼接图片的url（绝对路径）
     image_url = constants.QINIU_DOMIN_PREFIX + image_name
     # 返回结果
@@ -256,11 +275,9 @@ def get_myhouse_info():
     # 判断查询结果
     if not real_name:
         return jsonify(errno=RET.NODATA,errmsg="用户未认证")
-    # 从数据库中获取房源信息
+    # 从数据库中获取房源信息，区域和房主信息与房屋一起查询
     try:
-        user = User.query.get(user_id)
-        # 使用反向引用
-        houses = user.houses
+        houses = House.query.options(*House.basic_query_options()).filter(House.user_id == user_id).all()
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg="查询用户房屋数据异常")
@@ -278,56 +295,55 @@ def get_myhouse_info():
 def get_house_index():
     """
     项目首页幻灯片
+    有序集合初始化后，直接按成交次数从首页幻灯片的有序集合中获取房屋，订单完成和房屋设置主图片时实时更新
+    有序集合未初始化时：
     1.尝试从缓存中获取房屋图片数据，缓存---数据库---缓存
-    2.如果有数据，留下访问redis的记录
-    3.返回redis中存储的图片数据
-    4.如果没有，从数据库中获取
-    5.对幻灯片的处理，默认是房屋成交次数，最多展示5条
-    6.判断获取结果
-    7.定义容器，遍历获取结果，判断房屋是否设置图片，如未设置，默认不添加
-    8.序列化房屋数据
-    9.保存到redis缓存中
-    10.返回结果
+    2.如果有数据，留下访问redis的记录，返回redis中存储的图片数据，缓存超过软过期时间时在后台刷新
+    3.如果没有，抢到重建锁的请求从数据库中获取，其他请求等待缓存重建
+    4.对幻灯片的处理，默认是房屋成交次数，只查询设置了主图片的房屋，最多展示5条
+    5.判断获取结果
+    6.定义容器，遍历获取结果
+    7.序列化房屋数据
+    8.保存到redis缓存中，同时缓存数据摘要和gzip压缩后的数据
+    9.返回结果，支持If-None-Match和gzip压缩
     :return:
     """
-    # 尝试从缓存中获取数据
+    # 从首页幻灯片的有序集合中获取房屋
     try:
-        ret = redis_store.get('home_page_data')
+        fragments = house_rank.get_home_houses()
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
-    # 判断获取结果，如果有数据，留下访问记录，直接返回结果
-    if ret:
-        current_app.logger.info('hit redis get home_page_data')
-        resp = '{"errno":0,"errmsg":"OK","data":%s}' % ret
-        return resp
-
-    # 查询数据库，默认按房屋成交数量进行排序
+        fragments = None
+    if fragments:
+        return make_cached_response('{"errno":0,"errmsg":"OK","data":[%s]}' % ",".join(fragments))
+
+    def rebuild():
+        # 查询数据库，默认按房屋成交数量进行排序，没有房屋主图片的房屋不展示
+        houses = House.query.options(*House.basic_query_options())\
+            .filter(House.index_image_url != None, House.index_image_url != "")\
+            .order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES).all()
+        # 判断查询结果
+        if not houses:
+            return None
+        # 定义容器，存储查询结果
+        houses_list = list()
+        for house in houses:
+            houses_list.append(house.to_basic_dict())
+        # 序列化房屋数据，缓存完整的响应报文
+        return '{"errno":0,"errmsg":"OK","data":%s}' % json.dumps(houses_list)
+
+    # 尝试从缓存中获取数据，缓存失效时只有一个请求查询数据库
     try:
-        houses = House.query.order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES)
+        resp = cache.get_or_rebuild(constants.HOME_PAGE_DATA_REDIS_KEY, rebuild,
+                                    constants.HOME_PAGE_DATA_REDIS_EXPIRES, serve_stale=True, local=True, compress=True)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg="查询房屋数据异常")
     # 判断查询结果
-    if not houses:
+    if resp is None:
         return jsonify(errno=RET.NODATA,errmsg="无房屋数据")
-    # 定义容器，存储查询结果
-    houses_list = list()
-    # 遍历查询结果，过滤没有房屋主图片的房屋数据
-    for house in houses:
-        if not house.index_image_url:
-            continue
-        houses_list.append(house.to_basic_dict())
-    # 序列化房屋数据
-    house_json = json.dumps(houses_list)
-    # 保存到redis缓存中
-    try:
-        redis_store.setex("home_page_data",constants.HOME_PAGE_DATA_REDIS_EXPIRES,house_json)
-    except Exception as e:
-        current_app.logger.error(e)
-    # 构造响应结果返回结果
-    resp = '{"errno":0,"errmsg":"OK","data":%s}' % house_json
-    return resp
+    # 返回结果，客户端数据未变化时返回304，支持gzip时直接返回压缩好的数据
+    return make_cached_response(resp)
 
 
 # 获取房屋详情模块
@@ -337,15 +353,15 @@ def get_house_detail(house_id):
     获取房屋详情信息
     1.尝试获取用户的身份 user_id
     2.校验house_id 参数的存在
-    3.尝试从redis中获取房屋的详情信息
-    4.校验查询结果
-    5.从数据库中获取房屋的详细数据
-    6.校验查询结果，确认房屋存在
-    7.调用模型类中的house.to_full_dict()
-    8.序列化数据
-    9.保存到redis缓存中
-    10.构造响应数据
-    11.返回结果
+    3.尝试从redis中获取房屋的详情信息，缓存超过软过期时间时返回旧数据并在后台刷新
+    4.如果没有，抢到重建锁的请求从数据库中获取房屋的详细数据，其他请求等待缓存重建
+    5.校验查询结果，确认房屋存在
+    6.调用模型类中的house.to_full_dict()
+    7.序列化数据
+    8.保存到redis缓存中
+    9.获取房屋评论第一页的缓存，评论与房屋信息分别缓存，新增评论时只删除评论的缓存
+    10.拼接房屋信息和评论构造响应数据
+    11.返回结果，支持If-None-Match
     :param house_id:
     :return:
     """
@@ -354,45 +370,145 @@ def get_house_detail(house_id):
     # 确认参数house_id的存在
     if not house_id:
         return jsonify(errno=RET.PARAMERR,errmsg="参数错误")
-    # 尝试从redis中获取房屋的信息
+
+    def rebuild():
+        # 查询数据库，获取房屋信息
+        house = House.query.get(house_id)
+        # 判断查询结果
+        if not house:
+            return None
+        # 调用模型类，获取房屋详情数据，序列化详情数据
+        return json.dumps(house.to_full_dict())
+
+    # 尝试从redis中获取房屋的信息，缓存失效时只有一个请求查询数据库
     try:
-        ret = redis_store.get("house_info_%s" % house_id)
+        house_json = cache.get_or_rebuild("house_info_%s" % house_id, rebuild,
+                                          constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND, serve_stale=True, local=True)
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
+        return jsonify(errno=RET.DBERR,errmsg="查询房屋详情数据异常")
     # 判断查询结果
-    if ret:
-        current_app.logger.info("hit redis house_detail_info")
-        resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,ret)
-        return resp
+    if house_json is None:
+        return jsonify(errno=RET.NODATA,errmsg="房屋不存在")
+    # 获取房屋评论第一页的缓存
+    try:
+        comments_json = _get_house_comments_fragment(house_id)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg="查询房屋评论数据异常")
+    # 房屋信息是json对象，在末尾拼接评论列表
+    house_json_with_comments = '%s,"comments":%s}' % (house_json[:-1], _comments_list_json(comments_json))
+    # 构造响应结果，响应中包含用户id，所以etag由房屋数据、评论数据的摘要和用户id组成，客户端数据未变化时返回304
+    resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json_with_comments)
+    return make_cached_response(resp, etag="%s-%s-%s" % (house_json.etag, comments_json.etag, user_id))
+
 
-    # 查询数据库，获取房屋信息
+def _query_house_comments(house_id, ctime=None, last_id=None):
+    """
+    查询一页房屋评论，游标为上一页最后一条评论的评价时间和订单编号
+    :return: (评论字典列表, 下一页的游标)，游标为空字符串表示没有下一页
+    """
+    orders = Order.comments_query(house_id)
+    if last_id is not None:
+        orders = orders.filter(pagination.keyset_filter(Order.update_time, Order.id, ctime, last_id))
+    # 多查询一条用于判断是否还有下一页
+    orders = orders.limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS + 1).all()
+    next_cursor = ""
+    if len(orders) > constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS:
+        orders = orders[:constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS]
+        last_order = orders[-1]
+        next_cursor = pagination.encode_cursor(last_order.update_time.strftime('%Y-%m-%d %H:%M:%S'), last_order.id)
+    return [order.to_comment_dict() for order in orders], next_cursor
+
+
+def _get_house_comments_fragment(house_id):
+    """获取房屋评论第一页的缓存，格式为{"next_cursor":"...","comments":[...]}"""
+    def rebuild():
+        comments, next_cursor = _query_house_comments(house_id)
+        return '{"next_cursor":"%s","comments":%s}' % (next_cursor, json.dumps(comments))
+
+    return cache.get_or_rebuild("house_comments_%s" % house_id, rebuild,
+                                constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND, serve_stale=True, local=True)
+
+
+def _comments_list_json(comments_json):
+    """从评论缓存中截取评论列表的json，游标只包含base64字符，评论列表固定在最后"""
+    return comments_json[comments_json.index('"comments":') + len('"comments":'):-1]
+
+
+# 房屋评论模块
+@api.route('/houses/<int:house_id>/comments',methods=['GET'])
+def get_house_comments(house_id):
+    """
+    获取房屋评论信息
+    1.获取参数：cursor，第一页不传或传空字符串
+    2.第一页直接返回与房屋详情共用的评论缓存
+    3.之后的页对游标进行解码，游标中保存的是上一页最后一条评论的评价时间和订单编号
+    4.使用一次join查询获取评论和评论用户
+    5.返回评论列表和next_cursor，next_cursor为空字符串表示没有下一页
+    """
+    cursor = request.args.get('cursor')
+    if not cursor:
+        try:
+            comments_json = _get_house_comments_fragment(house_id)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR,errmsg="查询房屋评论数据异常")
+        return make_cached_response('{"errno":0,"errmsg":"OK","data":%s}' % comments_json, etag=comments_json.etag)
+    # 对游标进行解码
     try:
-        house = House.query.get(house_id)
+        ctime, last_id = pagination.decode_cursor(cursor)
+        ctime = datetime.datetime.strptime(ctime, '%Y-%m-%d %H:%M:%S')
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg="查询房屋数据异常")
-    # 判断查询结果
-    if not house:
-        return jsonify(errno=RET.NODATA,errmsg="房屋不存在")
+        return jsonify(errno=RET.PARAMERR,errmsg="游标格式错误")
+    try:
+        comments, next_cursor = _query_house_comments(house_id, ctime, last_id)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg="查询房屋评论数据异常")
+    return jsonify(errno=RET.OK,errmsg="OK",data={"next_cursor":next_cursor,"comments":comments})
 
-    # 调用模型类，获取房屋详情数据
+
+def get_houses_by_ids(ids):
+    """
+    批量获取房屋详细信息，与房屋详情页共用house_info缓存，不包括评论信息
+    1.对房屋编号进行检查，多个编号使用逗号分隔
+    2.使用一次mget获取所有房屋的缓存
+    3.未命中的房屋使用一次批量查询重建，通过pipeline写回redis
+    4.按请求中的顺序拼接响应，不存在的房屋不返回
+    """
     try:
-        # 因为to_full_dict方法里面实现房屋详情数据,需要查询数据库,所以进行异常处理
-        house_data = house.to_full_dict()
+        house_ids = [int(house_id) for house_id in ids.split(',') if house_id]
+        assert 0 < len(house_ids) <= constants.HOUSE_MULTI_GET_MAX_COUNT
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg="查询房屋详情数据异常")
-    # 序列化详情数据
-    house_json = json.dumps(house_data)
-    # 保存到缓存中
+        return jsonify(errno=RET.PARAMERR,errmsg="房屋编号错误")
+
+    def rebuild_many(keys):
+        missing_ids = [int(key[len("house_info_"):]) for key in keys]
+        houses = House.query.options(*House.full_query_options()).filter(House.id.in_(missing_ids)).all()
+        return dict(("house_info_%s" % house.id, json.dumps(house.to_full_dict())) for house in houses)
+
+    keys = ["house_info_%s" % house_id for house_id in house_ids]
     try:
-        redis_store.setex('house_info_%s' % house_id,constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND,house_json)
+        houses_json = cache.get_many(keys, rebuild_many, constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND,
+                                     serve_stale=True, local=True)
     except Exception as e:
         current_app.logger.error(e)
-    # 构造响应结果，返回结果
-    resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
-    return resp
+        return jsonify(errno=RET.DBERR,errmsg="查询房屋详情数据异常")
+    houses_json_list = [houses_json[key] for key in keys if key in houses_json]
+    resp = '{"errno":0,"errmsg":"OK","data":{"houses":[%s]}}' % ",".join(houses_json_list)
+    return make_cached_response(resp)
+
+
+# 房屋列表页支持的排序方式，sort_key: (排序字段, 是否降序)，默认按房屋发布时间最新排序
+HOUSE_LIST_ORDERINGS = {
+    "new": (House.create_time, True),
+    "booking": (House.order_count, True),
+    "price-inc": (House.price, False),
+    "price-des": (House.price, True),
+}
 
 
 # 房屋列表页模块
@@ -403,33 +519,41 @@ def get_houses_list():
     缓存----磁盘----缓存
     业务逻辑：获取参数，校验参数，业务处理，返回结果
     目的：根据用户选择的参数信息，把符合要求的房屋数据返回给用户
-    1.获取参数：sd,ed,aid,sk,p
+    1.获取参数：sd,ed,aid,sk,p,cursor
     2.对日期进行格式化处理
     3.开始日期必须小于等于结束日期
     4.对页数进行格式化处理
-    5.尝试从redis中获取房屋的列表信息，使用哈希数据类型
-    6.判断获取结果，如果有数据，留下访问记录，直接返回
-    7.查询mysql数据库
+    5.没有选择日期时，从redis中按区域和排序方式维护的有序集合获取房屋列表，否则尝试从redis中获取房屋的列表信息，使用哈希数据类型
+    6.判断获取结果，如果有数据，留下访问记录，直接返回，缓存超过软过期时间时在后台刷新
+    7.查询mysql数据库，同一页数据同一时间只有抢到重建锁的请求查询，其他请求等待缓存重建
     8.定义容器列表，存储用户选择的条件参数（查询的过滤条件）
     9.判断区域参数是否存在，如果存在，添加到列表中
-    10.判断日期参数是否存在，将得到的日期和数据库中订单的日期进行比较，返回满足条件的房屋信息
+    10.判断日期参数是否存在，查询候选房屋的预订位图，过滤掉日期有冲突的房屋
     11.判断排序条件，根据排序条件执行查询数据库的操作
-    12.根据排序结果进行分页处理，paginate返回结果包括总页数和房屋数据
+    12.根据排序结果进行分页处理，总页数由按区域和日期条件缓存的房屋总数计算，各排序方式和页数共用
     13.遍历房屋数据，调用模型类中的方法，获取房屋的基本信息
     14.构造响应报文
     15.序列化数据
     16.将房屋数据写入到缓存中（判断用户选择的页数小于分页的总页数，本质上是用户选择的页数是有数据的）
-    17.构造redis_key,存储房屋列表页的缓存数据，,因为使用的是hash数据类型,为了确保数据的完整性,需要使用事务;开启事务,存储数据,设置有效期,执行事务/
-    pip = redis_store.pipeline()
+    17.构造redis_key,存储房屋列表页的缓存数据，,因为使用的是hash数据类型,为了确保数据的完整性,需要使用事务;开启事务,存储数据,设置有效期,执行事务
     18.返回结果resp_json
+    游标分页：传入cursor参数时（第一页传空字符串），不再使用p参数和OFFSET分页，
+    根据游标中上一页最后一套房屋的排序字段值和房屋编号查询下一页，返回next_cursor，
+    next_cursor为空字符串表示没有下一页
+    批量获取：传入ids参数时返回这些房屋的详细信息，见get_houses_by_ids
     :return:
     """
+    # 传入房屋编号时批量获取房屋详细信息
+    ids = request.args.get('ids')
+    if ids is not None:
+        return get_houses_by_ids(ids)
     # 获取参数，area_id,start_date_str,end_date_str,sort_key,page
     area_id = request.args.get('aid','')
     start_date_str = request.args.get('sd','')
     end_date_str = request.args.get('ed','')
     sort_key = request.args.get('sk','new')
     page = request.args.get('p',1)
+    cursor = request.args.get('cursor')
     # 参数处理,对日期进行处理
     try:
         # 保存格式化后的日期
@@ -452,95 +576,238 @@ def get_houses_list():
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.PARAMERR,errmsg="页数格式化错误")
-    # 尝试从redis缓存中获取房屋的列表数据,因为多条数据的存储,使用的hash数据类型,首先需要键值
-    try:
-        # redis_key相当于hash的对象，里面存储的是页数和房屋数据
-        redis_key = 'houses_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key)
-        # 根据redis_key 获取缓存数据
-        ret = redis_store.hget(redis_key,page)
-    except Exception as e:
-        current_app.logger.error(e)
-        ret = None
-    # 判断获取结果,如果有数据，留下记录返回结果
-    if ret:
-        current_app.logger.info('hit redis houses_list_info')
-        # ret里面已经是完整的响应报文,所以可以直接返回
-        return ret
-    # 查询磁盘数据库，过滤条件---查询数据库---排序---分页，得到满足条件的房屋
-    try:
+    # 获取排序方式
+    sort_column, sort_desc = HOUSE_LIST_ORDERINGS.get(sort_key, HOUSE_LIST_ORDERINGS["new"])
+    # 对游标进行解码，游标中保存的是上一页最后一套房屋的排序字段值和房屋编号
+    if cursor:
+        try:
+            sort_value, last_id = pagination.decode_cursor(cursor)
+            if sort_column is House.create_time:
+                sort_value = datetime.datetime.strptime(sort_value, '%Y-%m-%d %H:%M:%S')
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg="游标格式错误")
+    # 没有选择日期时，直接从redis中按区域和排序方式维护的有序集合获取房屋列表，不需要查询mysql
+    if not (start_date_str or end_date_str):
+        try:
+            if cursor is None:
+                ret = house_rank.get_houses_page(area_id, sort_key, page)
+                if ret is not None:
+                    resp_json = '{"errno":0,"errmsg":"OK","data":{"houses":[%s],"total_page":%s,"current_page":%s}}' \
+                                % (",".join(ret[0]), ret[1], page)
+            else:
+                ret = house_rank.get_houses_after(area_id, sort_key, (sort_value, last_id) if cursor else None)
+                if ret is not None:
+                    resp_json = '{"errno":0,"errmsg":"OK","data":{"houses":[%s],"next_cursor":"%s"}}' \
+                                % (",".join(ret[0]), ret[1])
+        except Exception as e:
+            current_app.logger.error(e)
+            ret = None
+        if ret is not None:
+            current_app.logger.info('hit redis houses_rank')
+            return make_cached_response(resp_json)
+    # 页数分页和游标分页的数据缓存在同一个hash中，redis_key相当于hash的对象，里面存储的是页数和房屋数据
+    redis_key = 'houses_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key)
+    redis_field = page if cursor is None else 'cursor_%s' % cursor
+    # 记录页数分页的总页数，用于判断能否写入缓存
+    page_info = {}
+
+    def rebuild():
+        # 查询磁盘数据库，过滤条件---查询数据库---排序---分页，得到满足条件的房屋
         # 定义容器，存储过滤条件
         params_filter = list()
+        # 符合条件的房屋总数，使用预订位图筛选时可以直接得出
+        total_count = None
         # 判断区域的存在
         if area_id:
             # 列表中添加的是sqlalchemy对象
             params_filter.append(House.area_id == area_id)
-        # 对日期参数进行查询，如果用户选择了开始和结束日期
-        if start_date and end_date:
-            # 存储有冲突的订单
-            conflict_orders = Order.query.filter(Order.begin_date<=end_date,Order.end_date>=start_date).all()
-            # 遍历有冲突的订单，获取有冲突的房屋
-            conflict_house_id = [order.house_id for order in conflict_orders]
-            # 判断有冲突的房屋的存在，取反获取没有冲突的房屋
-            if conflict_house_id:
-                params_filter.append(House.id.notin_(conflict_house_id))
-        # 如果用户只选择了开始日期
-        elif start_date:
-            conflict_orders = Order.query.filter(Order.end_date>=start_date).all()
-            conflict_house_id = [order.house_id for order in conflict_orders]
-            if conflict_house_id:
-                params_filter.append(House.id.notin_(conflict_house_id))
-        # 如果用户只选择了结束日期
-        elif end_date:
-            conflict_orders = Order.query.filter(Order.begin_date <= end_date).all()
-            conflict_house_id = [order.house_id for order in conflict_orders]
+        # 对日期参数进行查询，通过房屋的预订位图过滤掉日期有冲突的房屋，只需检查满足区域条件的候选房屋
+        if start_date or end_date:
+            candidate_ids = [house.id for house in House.query.with_entities(House.id).filter(*params_filter)]
+            try:
+                conflict_house_id = availability.get_booked_houses(candidate_ids, start_date, end_date)
+            except Exception as e:
+                current_app.logger.error(e)
+                conflict_house_id = None
+            # 预订位图不可用或未初始化时，退回到查询订单表
+            if conflict_house_id is None:
+                conflict_orders = availability.conflict_orders_query(start_date, end_date)
+                params_filter.append(House.id.notin_(conflict_orders.subquery()))
+            # 取反获取没有冲突的房屋
             if conflict_house_id:
                 params_filter.append(House.id.notin_(conflict_house_id))
-        # 过滤条件实现后，执行查询排序操作
-        # 按成交次数排序
-        if 'booking' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.order_count.desc())
-        # 按价格升序排序
-        elif 'price-inc' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.asc())
-        # 按价格降序排序
-        elif 'price-des' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.desc())
-        # 默认排序方式 房屋发布时间最新
+            # 有冲突的房屋都在候选房屋中，两者相减即为符合条件的房屋总数
+            if conflict_house_id is not None:
+                total_count = len(candidate_ids) - len(conflict_house_id)
+        # 过滤条件实现后，执行查询排序操作，使用房屋编号作为第二排序字段，保证排序结果稳定
+        houses = House.query.options(*House.basic_query_options()).filter(*params_filter)
+        if sort_desc:
+            houses = houses.order_by(sort_column.desc(), House.id.desc())
         else:
-            houses = House.query.filter(*params_filter).order_by(House.create_time.desc())
+            houses = houses.order_by(sort_column.asc(), House.id.asc())
 
-        # 对排序结果进行分页操作False表示分页异常不报错
-        house_page = houses.paginate(page,constants.HOUSE_LIST_PAGE_CAPACITY,False)
-        # 获取分页后房屋数据和总页数
-        house_list = house_page.items
-        total_page = house_page.pages
+        if cursor is None:
+            # 获取房屋总数，不再每页都执行COUNT查询，而是读取按区域和日期条件缓存的总数
+            total_approx = False
+            if total_count is None:
+                total_count, total_approx = house_count.get_houses_count(params_filter, area_id,
+                                                                         start_date_str, end_date_str)
+            # 对排序结果进行分页操作
+            house_list = houses.limit(constants.HOUSE_LIST_PAGE_CAPACITY)\
+                .offset(max(page - 1, 0) * constants.HOUSE_LIST_PAGE_CAPACITY).all()
+            # 计算总页数
+            page_info["total_page"] = (total_count + constants.HOUSE_LIST_PAGE_CAPACITY - 1) \
+                // constants.HOUSE_LIST_PAGE_CAPACITY
+        else:
+            # 游标分页，只查询游标之后的数据，多查询一条用于判断是否还有下一页
+            if cursor:
+                houses = houses.filter(pagination.keyset_filter(sort_column, House.id, sort_value, last_id, sort_desc))
+            house_list = houses.limit(constants.HOUSE_LIST_PAGE_CAPACITY + 1).all()
+            next_cursor = ""
+            if len(house_list) > constants.HOUSE_LIST_PAGE_CAPACITY:
+                house_list = house_list[:constants.HOUSE_LIST_PAGE_CAPACITY]
+                last_house = house_list[-1]
+                last_value = getattr(last_house, sort_column.key)
+                if sort_column is House.create_time:
+                    last_value = last_value.strftime('%Y-%m-%d %H:%M:%S')
+                next_cursor = pagination.encode_cursor(last_value, last_house.id)
         # 定义容器，遍历分页后的房屋数据，调用模型类中的方法，获取房屋的基本信息
         houses_dict_list = []
         for house in house_list:
             houses_dict_list.append(house.to_basic_dict())
-    except Exception as e:
-        current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg="查询房屋列表信息异常")
-    # 构造响应报文
-    resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,"total_page":total_page,"current_page":page}}
-    # 序列化数据
-    resp_json = json.dumps(resp)
-    # 存储序列化的房屋数据列表
-    # 判断用户请求的页数小于总页数，即用户请求的页数有数据
-    if page <= total_page:
-        redis_key = 'houses_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key)
-        # 使用事务对多条数据同时进行操作
-        pip = redis_store.pipeline()
+        # 构造响应报文
+        if cursor is None:
+            resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,
+                                                   "total_page":page_info["total_page"],"current_page":page}}
+            # 房屋总数超过统计上限时，总页数为近似值
+            if total_approx:
+                resp["data"]["total_approx"] = True
+        else:
+            resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,"next_cursor":next_cursor}}
+        # 记录区域内的列表页缓存键，订单变化时按区域删除，不需要扫描整个redis
         try:
-            # 开启事务
-            pip.multi()
-            # 存储数据
-            pip.hset(redis_key,page,resp_json)
-            # 设置过期时间
-            pip.expire(redis_key,constants.HOUSE_LIST_REDIS_EXPIRES)
-            # 执行事务
-            pip.execute()
+            house_list_keys.record_key(area_id, redis_key)
         except Exception as e:
             current_app.logger.error(e)
-    # 返回响应数据
-    return resp_json
+        # 序列化数据
+        return json.dumps(resp)
+
+    def cacheable(resp_json):
+        # 判断用户请求的页数小于总页数，即用户请求的页数有数据，游标分页的数据都是有效的
+        return cursor is not None or page <= page_info["total_page"]
+
+    # 尝试从redis缓存中获取房屋的列表数据，缓存失效时只有一个请求查询数据库并写入缓存
+    try:
+        resp_json = cache.get_or_rebuild(redis_key, rebuild, constants.HOUSE_LIST_REDIS_EXPIRES,
+                                         field=redis_field, cacheable=cacheable, serve_stale=True, compress=True)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg="查询房屋列表信息异常")
+    # 返回响应数据，缓存里面已经是完整的响应报文,所以可以直接返回，支持If-None-Match和gzip压缩
+    return make_cached_response(resp_json)
+
+
+# 设置房屋价格日历模块
+@api.route('/houses/<int:house_id>/prices',methods=['PUT'])
+@login_required
+def save_house_prices(house_id):
+    """
+    设置房屋价格日历
+    1.获取参数：weekend_price,seasons，价格单位为元
+    2.对参数进行检查，价格转换为分，季节价格的日期进行格式化
+    3.查询房屋，确保只能设置自己的房屋
+    4.从当天开始构造价格日历，季节价格覆盖周末价格，未设置的日期使用房屋单价
+    5.保存价格日历到数据库
+    6.返回结果
+    """
+    user_id = g.user_id
+    # 获取参数
+    req_data = request.get_json()
+    if not req_data:
+        return jsonify(errno=RET.PARAMERR,errmsg="参数错误")
+    weekend_price = req_data.get("weekend_price")
+    seasons = req_data.get("seasons") or []
+    # 对价格和日期进行转换
+    try:
+        weekend_price = int(float(weekend_price) * 100) if weekend_price else None
+        overrides = []
+        for season in seasons:
+            begin = datetime.datetime.strptime(season["start_date"], '%Y-%m-%d').date()
+            end = datetime.datetime.strptime(season["end_date"], '%Y-%m-%d').date()
+            price = int(float(season["price"]) * 100)
+            assert begin <= end and price > 0
+            overrides.append((begin, end, price))
+        assert weekend_price is None or weekend_price > 0
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR,errmsg="价格或日期格式错误")
+    # 查询房屋信息
+    try:
+        house = House.query.get(house_id)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg="查询房屋信息异常")
+    if not house or house.user_id != user_id:
+        return jsonify(errno=RET.NODATA,errmsg="无房屋数据")
+    # 构造并保存价格日历
+    start_date = datetime.date.today()
+    try:
+        prices = price_calendar.build_prices(start_date, weekend_price, overrides)
+        price_calendar.save_calendar(house_id, start_date, prices)
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error(e)
+        db.session.rollback()
+        return jsonify(errno=RET.DBERR,errmsg="保存价格日历失败")
+    return jsonify(errno=RET.OK,errmsg="OK")
+
+
+# 批量计算房屋总价模块
+@api.route('/houses/quotes',methods=['GET'])
+def get_house_quotes():
+    """
+    批量计算房屋在日期范围内的总价，用于房屋列表页一次显示整页房屋的总价
+    1.获取参数：ids,sd,ed
+    2.对房屋编号和日期进行检查，日期范围不超过价格日历的天数
+    3.使用一次查询获取房屋单价，使用一次查询获取价格日历
+    4.按每天的价格向量化求和
+    5.返回每套房屋的入住天数和总价，单位：分
+    """
+    # 获取参数
+    ids = request.args.get('ids','')
+    start_date_str = request.args.get('sd','')
+    end_date_str = request.args.get('ed','')
+    # 对房屋编号进行检查
+    try:
+        house_ids = [int(house_id) for house_id in ids.split(',') if house_id]
+        assert 0 < len(house_ids) <= constants.HOUSE_QUOTE_MAX_COUNT
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR,errmsg="房屋编号错误")
+    # 对日期进行格式化
+    try:
+        start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        assert start_date <= end_date
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR,errmsg="日期格式错误")
+    days = (end_date - start_date).days + 1
+    # 限制日期范围，避免按天计算总价时占用过多内存
+    if days > constants.HOUSE_PRICE_CALENDAR_DAYS:
+        return jsonify(errno=RET.PARAMERR,errmsg="日期范围过长")
+    # 查询房屋单价并计算总价
+    try:
+        houses = House.query.options(load_only("id", "price")).filter(House.id.in_(house_ids)).all()
+        amounts = price_calendar.quote(houses, start_date, end_date)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg="计算房屋总价失败")
+    # 按请求中的顺序返回，不存在的房屋不返回
+    quotes = dict((house.id, int(amount)) for house, amount in zip(houses, amounts))
+    quotes_list = []
+    for house_id in house_ids:
+        if house_id in quotes:
+            quotes_list.append({"house_id":house_id,"days":days,"amount":quotes[house_id]})
+    return jsonify(errno=RET.OK,errmsg="OK",data={"quotes":quotes_list})
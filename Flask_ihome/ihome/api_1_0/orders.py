@@ -10,8 +10,20 @@ from ihome.utils.commons import login_required
 from ihome.utils.response_code import RET
 # 导入模型类对象
 from ihome.models import House,Order
-# 导入数据库对象
-from ihome import db,redis_store
+# 导入数据库对象和常量信息
+from ihome import db,redis_store,constants
+# 导入房屋预订位图
+from ihome.utils import availability
+# 导入订单事件队列
+from ihome.utils import order_events
+# 导入待接单订单的截止时间
+from ihome.utils import order_expiry
+# 导入房屋价格日历
+from ihome.utils import price_calendar
+# 导入游标分页工具
+from ihome.utils import pagination
+# 导入关联对象的加载选项
+from sqlalchemy.orm import contains_eager
 # 导入时间模块
 import datetime
 
@@ -45,31 +57,42 @@ def save_orders():
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.PARAMERR,errmsg="日期格式错误")
-    # 查询房屋是否存在
+    # 查询房屋是否存在，使用SELECT ... FOR UPDATE锁定房屋记录直到事务提交
+    # 同一房屋的下单请求依次执行冲突检查和保存订单，不同房屋的下单互不影响
     try:
-        house = House.query.get(house_id)
+        house = House.query.filter_by(id=house_id).with_for_update().first()
     except Exception as e:
         current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="获取房屋信息失败")
     # 判断查询结果
     if not house:
+        db.session.rollback()
         return jsonify(errno=RET.NODATA,errmsg="无房屋数据信息")
     # 预定的房屋是否是房东自己的
     if user_id == house.user_id:
+        db.session.rollback()
         return jsonify(errno=RET.ROLEERR,errmsg="不能预定自己的房间")
     # 确保用户预定的时间内，房屋没有被比人下单
+    # 持有房屋记录的锁之后再检查，其他请求已提交的订单都能查到，未提交的请求还在等待锁
     try:
         # 查询时间冲突的订单数
-        count = Order.query.filter(Order.house_id == house_id,
-                                   Order.begin_date <= end_date,
-                                   Order.end_date >= start_date).count()
+        count = availability.conflict_orders_query(start_date, end_date, house_id=house_id).count()
     except Exception as e:
         current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="检查出错，稍后再试")
     if count > 0:
+        # 回滚释放房屋记录的锁
+        db.session.rollback()
         return jsonify(errno=RET.DATAERR,errmsg="房屋已经被预定")
-    # 订单总额
-    amount = days*house.price
+    # 订单总额，按房屋价格日历中每天的价格计算
+    try:
+        amount = int(price_calendar.quote([house], start_date, end_date)[0])
+    except Exception as e:
+        current_app.logger.error(e)
+        db.session.rollback()
+        return jsonify(errno=RET.DBERR,errmsg="计算订单金额失败")
     # 保存订单数据
     order = Order()
     order.house_id = house_id
@@ -79,7 +102,7 @@ def save_orders():
     order.days = days
     order.house_price = house.price
     order.amount = amount
-    # 保存到数据库中
+    # 保存到数据库中，提交事务的同时释放房屋记录的锁
     try:
         db.session.add(order)
         db.session.commit()
@@ -88,6 +111,13 @@ def save_orders():
         # 操作错误，进行回滚
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="保存数据失败")
+    # 记录订单的接单截止时间，超时未接单的订单由后台进程自动取消
+    try:
+        order_expiry.add_order(order.id)
+    except Exception as e:
+        current_app.logger.error(e)
+    # 发布订单创建事件，由后台进程更新预订位图和房屋列表页的缓存
+    order_events.publish(order_events.ORDER_CREATED, order)
     return jsonify(errno=RET.OK,errmsg="OK",data={"order_id":order.id})
 
 
@@ -95,31 +125,73 @@ def save_orders():
 @api.route('/user/orders',methods=['GET'])
 @login_required
 def get_user_orders():
-    """查询用户订单信息模块"""
+    """
+    查询用户订单信息模块
+    1.获取参数：role,status,cursor
+    2.对状态参数进行检查，多个状态使用逗号分隔
+    3.对游标进行解码，游标中保存的是上一页最后一个订单的创建时间和订单编号
+    4.订单与房屋使用一次join查询，房屋信息随订单一起加载
+    5.房东身份按房屋的房东过滤，房客身份按下单用户过滤
+    6.按创建时间和订单编号降序排序，传入cursor参数时进行游标分页，否则返回全部订单
+    7.返回订单列表，游标分页时返回next_cursor，为空字符串表示没有下一页
+    """
     user_id = g.user_id
     # 用户的身份，是客户还是房东
     role = request.args.get('role','')
+    # 订单状态，可选参数
+    status = request.args.get('status','')
+    # 游标分页的游标，第一页传空字符串
+    cursor = request.args.get('cursor')
+    # 对状态参数进行检查
+    status_list = [item for item in status.split(',') if item]
+    if not set(status_list) <= set(Order.status.type.enums):
+        return jsonify(errno=RET.PARAMERR,errmsg="订单状态错误")
+    # 对游标进行解码
+    if cursor:
+        try:
+            ctime, last_id = pagination.decode_cursor(cursor)
+            ctime = datetime.datetime.strptime(ctime, '%Y-%m-%d %H:%M:%S')
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg="游标格式错误")
     # 查询订单数据
     try:
+        orders = Order.query.join(Order.house).options(*Order.list_query_options())
         if 'landlord' == role:
-            # 以房东的身份进行查询
-            # 先查询属于自己的房屋有哪些
-            houses = House.query.filter(House.user_id == user_id).all()
-            houses_ids = [houses.id for house in houses]
-            # 在查询预定了自己房屋的有哪些
-            orders = Order.query.filter(Order.house_id.in_(houses_ids)).order_by(Order.create_time.desc()).all()
+            # 以房东的身份进行查询，查询预定了自己房屋的订单
+            orders = orders.filter(House.user_id == user_id)
         else:
             # 以房客的身份进行查询，查看自己预定的房屋订单
-            orders = Order.query.filter(Order.user_id == user_id).order_by(Order.create_time.desc()).all()
+            orders = orders.filter(Order.user_id == user_id)
+        if status_list:
+            orders = orders.filter(Order.status.in_(status_list))
+        # 创建时间可能重复，使用订单编号作为第二排序字段
+        orders = orders.order_by(Order.create_time.desc(), Order.id.desc())
+        if cursor is None:
+            order_list = orders.all()
+        else:
+            # 游标分页，只查询游标之后的数据，多查询一条用于判断是否还有下一页
+            if cursor:
+                orders = orders.filter(pagination.keyset_filter(Order.create_time, Order.id, ctime, last_id))
+            order_list = orders.limit(constants.ORDER_LIST_PAGE_CAPACITY + 1).all()
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg="查询订单信息失败")
+    resp_data = {}
+    if cursor is not None:
+        next_cursor = ""
+        if len(order_list) > constants.ORDER_LIST_PAGE_CAPACITY:
+            order_list = order_list[:constants.ORDER_LIST_PAGE_CAPACITY]
+            last_order = order_list[-1]
+            next_cursor = pagination.encode_cursor(last_order.create_time.strftime('%Y-%m-%d %H:%M:%S'),
+                                                   last_order.id)
+        resp_data["next_cursor"] = next_cursor
     # 定义容器 将订单对象转换未字典数据
     orders_dict_list = []
-    if orders:
-        for order in orders:
-            orders_dict_list.append(order.to_dict())
-    return jsonify(errno=RET.OK,errmsg='OK',data={"orders":orders_dict_list})
+    for order in order_list:
+        orders_dict_list.append(order.to_dict())
+    resp_data["orders"] = orders_dict_list
+    return jsonify(errno=RET.OK,errmsg='OK',data=resp_data)
 
 
 # 接单拒单模块
@@ -138,13 +210,17 @@ def accept_reject_order(order_id):
         return jsonify(errno=RET.PARAMERR,errmsg="参数错误")
     try:
         # 根据订单号查询订单，并且要求订单处于待接单的状态
-        order = Order.query.filter(Order.id == order_id,Order.status == "WAIT_ACCEPT").first()
-        house = order.house
+        # 加行锁，超时取消订单的后台进程同时修改订单时，等待对方提交后按最新状态判断
+        order = Order.query.filter(Order.id == order_id,Order.status == "WAIT_ACCEPT")\
+            .with_for_update().first()
+        house = order.house if order else None
     except Exception as e:
         current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="无法获取订单数据")
     # 确保房东只能修改属于自己的房屋订单
     if not order or house.user_id != user_id:
+        db.session.rollback()
         return jsonify(errno=RET.REQERR,errmsg="无效操作")
     if action == "accept":
         # 接单，讲订单状态设为等待评论
@@ -153,6 +229,7 @@ def accept_reject_order(order_id):
         # 拒单，要去拒单原因
         reason = req_data.get("reason")
         if not reason:
+            db.session.rollback()
             return jsonify(errno=RET.PARAMERR,errmsg="参数错误")
         order.status = "REJECTED"
         order.comment = reason
@@ -163,9 +240,102 @@ def accept_reject_order(order_id):
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="操作失败")
+    # 发布接单、拒单事件，拒单后由后台进程释放预订位图中占用的日期
+    if action == "accept":
+        order_events.publish(order_events.ORDER_ACCEPTED, order)
+    else:
+        order_events.publish(order_events.ORDER_REJECTED, order)
     return jsonify(errno=RET.OK,errmsg="OK")
 
 
+# 批量接单拒单模块
+@api.route('/orders/status',methods=["PUT"])
+@login_required
+def batch_accept_reject_orders():
+    """
+    批量接单、拒单模块
+    1.获取参数：orders，每一项包括order_id,action,reason
+    2.逐项检查参数，参数错误的订单直接记录处理结果
+    3.使用一次查询获取属于当前房东且处于待接单状态的订单，房屋信息随订单一起加载
+    4.修改订单状态，所有订单在一个事务中提交
+    5.接单和拒单各发布一个事件，相关缓存只删除一次
+    6.返回每个订单的处理结果
+    """
+    user_id = g.user_id
+    # 获取参数
+    req_data = request.get_json()
+    if not req_data:
+        return jsonify(errno=RET.PARAMERR,errmsg="参数错误")
+    items = req_data.get("orders")
+    if not isinstance(items, list) or not items:
+        return jsonify(errno=RET.PARAMERR,errmsg="参数错误")
+    if len(items) > constants.ORDER_BATCH_MAX_COUNT:
+        return jsonify(errno=RET.PARAMERR,errmsg="订单数量超过限制")
+    # 每个订单的处理结果，order_id: (errno, errmsg)
+    results = {}
+    # 参数正确的订单，order_id: (action, reason)
+    actions = {}
+    for item in items:
+        try:
+            order_id = int(item["order_id"])
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg="订单编号错误")
+        action = item.get("action")
+        reason = item.get("reason")
+        if action not in ("accept","reject") or (action == "reject" and not reason):
+            results[order_id] = (RET.PARAMERR, "参数错误")
+        else:
+            actions[order_id] = (action, reason)
+    # 查询属于当前房东且处于待接单状态的订单，加行锁，与超时取消订单的后台进程互斥
+    orders = []
+    if actions:
+        try:
+            orders = Order.query.join(Order.house)\
+                .options(contains_eager(Order.house).load_only("id", "user_id", "area_id"))\
+                .filter(Order.id.in_(actions.keys()),House.user_id == user_id,
+                        Order.status == "WAIT_ACCEPT").with_for_update(of=Order).all()
+        except Exception as e:
+            current_app.logger.error(e)
+            db.session.rollback()
+            return jsonify(errno=RET.DBERR,errmsg="无法获取订单数据")
+    accepted_orders = []
+    rejected_orders = []
+    for order in orders:
+        action, reason = actions[order.id]
+        if action == "accept":
+            # 接单，讲订单状态设为等待评论
+            order.status = "WAIT_COMMENT"
+            accepted_orders.append(order)
+        else:
+            order.status = "REJECTED"
+            order.comment = reason
+            rejected_orders.append(order)
+        db.session.add(order)
+        results[order.id] = (RET.OK, "OK")
+    # 不存在、不属于当前房东或已处理过的订单
+    for order_id in actions:
+        if order_id not in results:
+            results[order_id] = (RET.REQERR, "无效操作")
+    if orders:
+        try:
+            db.session.commit()
+        except Exception as e:
+            current_app.logger.error(e)
+            db.session.rollback()
+            return jsonify(errno=RET.DBERR,errmsg="操作失败")
+    # 发布接单、拒单事件，由后台进程释放拒单占用的日期并删除相关缓存
+    order_events.publish(order_events.ORDER_ACCEPTED, *accepted_orders)
+    order_events.publish(order_events.ORDER_REJECTED, *rejected_orders)
+    # 按请求中的顺序返回处理结果
+    results_list = []
+    for item in items:
+        order_id = int(item["order_id"])
+        errno, errmsg = results[order_id]
+        results_list.append({"order_id":order_id,"errno":errno,"errmsg":errmsg})
+    return jsonify(errno=RET.OK,errmsg="OK",data={"results":results_list})
+
+
 # 保存订单评论信息模块
 @api.route('/orders/<int:order_id>/comment',methods=['PUT'])
 @login_required
@@ -202,10 +372,8 @@ def save_order_comment(order_id):
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg="操作失败")
-    # 因房屋的详情中有订单评价信息，为了让最新的评价信息展示在房屋详情中，所以删除redis中本订单的缓存
-    try:
-        redis_store.delete("house_info_%s" % order.house.id)
-    except Exception as e:
-        current_app.logger.error(e)
+    # 发布订单完成事件，房屋详情中有订单评价信息，成交次数也影响首页和房屋列表页的排序
+    # 由后台进程更新有序集合并删除相关的缓存
+    order_events.publish(order_events.ORDER_COMPLETED, order)
 
     return jsonify(errno=RET.OK,errmsg="OK")
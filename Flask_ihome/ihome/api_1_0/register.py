@@ -2,8 +2,8 @@
 
 # 导入蓝图对象api
 from . import api
-# 从captcha扩展包中导入captcha
-from ihome.utils.captcha.captcha import captcha
+# 导入预先生成的图片验证码池
+from ihome.utils import captcha_pool
 # 导入redis数据库
 from ihome import redis_store,constants,db
 # 导入current_app
@@ -12,8 +12,8 @@ from flask import current_app,jsonify,make_response,request,session
 from ihome.utils.response_code import RET
 # 导入用户信息模块
 from ihome.models import User
-# 导入云通讯扩展包
-from ihome.utils import sms
+# 导入短信发送队列
+from ihome.utils import sms_queue
 # 导入正则re
 import re
 import random
@@ -22,15 +22,15 @@ import random
 def generate_image_code(image_code_id):
     """
     生成图片验证码
-    1.导入使用captcha包扩展包，生成图片验证码，name,text,image
+    1.从预先生成的验证码池中取出图片验证码text,image，池中没有时同步生成
     2.在服务器中保存图片验证码，保存到redis中，
     3.如果保存失败，返回错误信息，保存到日志中
     4.返回图片，使用make_response对象
     :param image_code_id:
     :return:
     """
-    # 生成图片验证码
-    name,text,image = captcha.generate_captcha()
+    # 从验证码池中取出图片验证码
+    text,image = captcha_pool.pop_captcha()
     # 保存图片验证码到redis中
     try:
         redis_store.setex('ImageCode_' + image_code_id, constants.IMAGE_CODE_REDIS_EXPIRES, text)
@@ -61,7 +61,7 @@ def send_sms_code(mobile):
     8.生成一个短信验证码，六位的随机数
     9.存数生成的验证码到redis中
     10.准备发送短信，判断用户是否依据能够注册，
-    11.保存发送结果，判断是否发送成功
+    11.把发送任务放入短信队列，由后台进程调用云通讯发送，失败时重试
     12.返回结果
     :param mobile:
     :return:
@@ -121,10 +121,9 @@ def send_sms_code(mobile):
     if user:
         return jsonify(errno=RET.DATAEXIST,errmsg="手机号已经注册")
 
-    # 调用云通讯发送验证码短信
+    # 放入短信队列，由后台进程发送验证码短信
     try:
-        send_sms = sms.CCP()
-        result = send_sms.send_template_sms(mobile,[sms_code,constants.SMS_CODE_REDIS_EXPIRES/60],1)
+        result = sms_queue.send_sms_code(mobile,sms_code)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.THIRDERR,errmsg="发送短信失败")
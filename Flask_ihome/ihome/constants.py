@@ -3,21 +3,60 @@
 # 图片验证码Redis有效期， 单位：秒
 IMAGE_CODE_REDIS_EXPIRES = 300
 
+# 预先生成的图片验证码池的最大数量
+CAPTCHA_POOL_SIZE = 1000
+
+# 图片验证码池每次补充的最大数量
+CAPTCHA_POOL_BATCH_SIZE = 50
+
+# 图片验证码池已满时，生成进程的检查间隔，单位：秒
+CAPTCHA_POOL_REFILL_INTERVAL = 1
+
+# 渲染图片验证码的进程池的进程数
+CAPTCHA_PROCESS_POOL_WORKERS = 4
+
+# 进程池中等待渲染的图片验证码的最大数量，超过时在当前进程中渲染
+CAPTCHA_PROCESS_POOL_MAX_PENDING = 16
+
+# 进程池渲染图片验证码的超时时间，超时后在当前进程中渲染，单位：秒
+CAPTCHA_PROCESS_POOL_TIMEOUT = 2
+
 # 短信验证码Redis有效期，单位：秒
 SMS_CODE_REDIS_EXPIRES = 300
 
+# 短信发送失败的最大重试次数，超过后放入死信队列
+SMS_SEND_MAX_RETRIES = 5
+
+# 短信发送失败后第一次重试的等待时间，之后每次加倍，单位：秒
+SMS_RETRY_BASE_DELAY = 2
+
+# 每次放回发送队列的到期重试任务的最大数量
+SMS_RETRY_BATCH_SIZE = 100
+
+# 短信后台进程等待新任务的超时时间，不超过重试的等待时间，单位：秒
+SMS_QUEUE_BLOCK_TIMEOUT = 1
+
+# 短信死信队列保留的最大任务数
+SMS_DEAD_QUEUE_MAX_SIZE = 1000
+
 # 七牛空间域名
 QINIU_DOMIN_PREFIX = "http://p3illzcls.bkt.clouddn.com/"
 
 # 城区信息redis缓存时间，单位：秒
 AREA_INFO_REDIS_EXPIRES = 7200
 
+# 城区信息的redis缓存键，缓存内容改为完整的响应报文后更换键名，避免读取到旧格式的缓存
+AREA_INFO_REDIS_KEY = "area_info_v2"
+
 # 首页展示最多的房屋数量
 HOME_PAGE_MAX_HOUSES = 5
 
 # 首页房屋数据的Redis缓存时间，单位：秒
 HOME_PAGE_DATA_REDIS_EXPIRES = 7200
 
+# 首页房屋数据的redis缓存键，缓存内容改为完整的响应报文后更换键名，避免读取到旧格式的缓存
+HOME_PAGE_DATA_REDIS_KEY = "home_page_data_v2"
+
 # 房屋详情页展示的评论最大数
 HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS = 30
 
@@ -29,3 +68,90 @@ HOUSE_LIST_PAGE_CAPACITY = 2
 
 # 房屋列表页面Redis缓存时间，单位：秒
 HOUSE_LIST_REDIS_EXPIRES = 7200
+
+# 房屋价格日历的天数
+HOUSE_PRICE_CALENDAR_DAYS = 366
+
+# 批量计算房屋总价每次最多的房屋数
+HOUSE_QUOTE_MAX_COUNT = 50
+
+# 批量获取房屋详细信息每次最多的房屋数
+HOUSE_MULTI_GET_MAX_COUNT = 50
+
+# 订单列表游标分页每页显示条目数
+ORDER_LIST_PAGE_CAPACITY = 10
+
+# 批量接单拒单每次最多处理的订单数
+ORDER_BATCH_MAX_COUNT = 50
+
+# 订单等待房东接单的时间，超时未接单自动取消，单位：秒
+ORDER_ACCEPT_EXPIRES = 86400
+
+# 每次取消的超时订单最大数量
+ORDER_EXPIRY_BATCH_SIZE = 100
+
+# 没有到期订单时，超时订单后台进程的检查间隔，单位：秒
+ORDER_EXPIRY_SWEEP_INTERVAL = 10
+
+# 房屋列表筛选结果总数的Redis缓存时间，单位：秒
+HOUSE_LIST_COUNT_REDIS_EXPIRES = 600
+
+# 房屋列表筛选结果总数的统计上限，超过上限时返回近似的总数，0表示不限制
+HOUSE_LIST_COUNT_LIMIT = 10000
+
+# 房屋基本信息片段Redis缓存时间，单位：秒
+HOUSE_BASIC_REDIS_EXPIRES = 7200
+
+# 缓存有效期随机增加的最大比例，避免同时写入的缓存集中过期
+CACHE_EXPIRES_JITTER = 0.1
+
+# 缓存重建锁的有效期，单位：秒
+CACHE_REBUILD_LOCK_EXPIRES = 10
+
+# 等待其他请求重建缓存的最长时间，单位：秒
+CACHE_REBUILD_WAIT_SECONDS = 1
+
+# 等待其他请求重建缓存期间读取缓存的间隔，单位：秒
+CACHE_REBUILD_POLL_INTERVAL = 0.05
+
+# 缓存超过软过期时间后仍可返回旧数据的宽限期，单位：秒
+CACHE_STALE_GRACE_SECONDS = 600
+
+# 缓存概率提前刷新的系数，越大越倾向于提前刷新
+CACHE_EARLY_REFRESH_BETA = 1.0
+
+# 后台刷新缓存的线程数
+CACHE_REFRESH_WORKERS = 4
+
+# 进程内缓存的最大条目数
+CACHE_LOCAL_MAX_SIZE = 256
+
+# 进程内缓存的有效期，单位：秒
+CACHE_LOCAL_EXPIRES = 60
+
+# 记录缓存访问次数的采样率
+CACHE_HOT_KEY_SAMPLE_RATE = 0.01
+
+# 缓存访问次数统计的有效期，单位：秒
+CACHE_HOT_KEY_EXPIRES = 172800
+
+# 各进程把缓存命中统计累加到redis的时间间隔，单位：秒
+CACHE_STATS_FLUSH_INTERVAL = 10
+
+# 缓存预热的热点缓存数量
+CACHE_WARMUP_TOP_KEYS = 200
+
+# 缓存预热的并发请求数，避免预热时数据库压力过大
+CACHE_WARMUP_WORKERS = 4
+
+# 缓存预热锁的有效期，多个进程启动时只有一个进程执行预热，单位：秒
+CACHE_WARMUP_LOCK_EXPIRES = 600
+
+# 订单事件处理失败的最大重试次数，超过后放入死信队列
+ORDER_EVENT_MAX_RETRIES = 5
+
+# 订单事件后台进程等待新事件的超时时间，单位：秒
+ORDER_EVENT_BLOCK_TIMEOUT = 5
+
+# 后台进程出现redis连接失败等异常后，重试前的等待时间，单位：秒
+WORKER_ERROR_RETRY_INTERVAL = 1
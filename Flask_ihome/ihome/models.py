@@ -2,6 +2,7 @@
 
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import contains_eager, joinedload, load_only, subqueryload
 from ihome import constants
 from . import db
 
@@ -95,6 +96,12 @@ class House(BaseModel, db.Model):
     """房屋信息"""
 
     __tablename__ = "ih_house_info"
+    __table_args__ = (
+        # 房屋列表页按区域筛选后按价格、成交次数、发布时间排序
+        db.Index("ix_ih_house_info_area_price", "area_id", "price"),
+        db.Index("ix_ih_house_info_area_order_count", "area_id", "order_count"),
+        db.Index("ix_ih_house_info_area_create_time", "area_id", "create_time"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)  # 房屋编号
     user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False)  # 房屋主人的用户编号
@@ -116,6 +123,32 @@ class House(BaseModel, db.Model):
     images = db.relationship("HouseImage")  # 房屋的图片
     orders = db.relationship("Order", backref="house")  # 房屋的订单
 
+    @staticmethod
+    def basic_query_options():
+        """
+        查询房屋基本信息时使用的加载选项，配合to_basic_dict使用
+        只加载to_basic_dict用到的字段，区域名字和房主头像通过join与房屋一起查询，
+        避免遍历房屋时逐个懒加载area和user，查询次数不随房屋数量增长
+        """
+        return (
+            load_only("id", "user_id", "area_id", "title", "price", "address", "room_count",
+                      "order_count", "index_image_url", "create_time"),
+            joinedload("area").load_only("name"),
+            joinedload("user").load_only("avatar_url"),
+        )
+
+    @staticmethod
+    def full_query_options():
+        """
+        批量查询房屋详细信息时使用的加载选项，配合to_full_dict使用
+        房主通过join与房屋一起查询，图片和设施各使用一次查询批量加载，查询次数不随房屋数量增长
+        """
+        return (
+            joinedload("user"),
+            subqueryload("images"),
+            subqueryload("facilities"),
+        )
+
     def to_basic_dict(self):
         """将基本信息转换为字典数据"""
         house_dict = {
@@ -133,7 +166,7 @@ class House(BaseModel, db.Model):
         return house_dict
 
     def to_full_dict(self):
-        """将详细信息转换为字典数据"""
+        """将详细信息转换为字典数据，不包括评论信息，评论信息单独缓存"""
         house_dict = {
             "hid": self.id,
             "user_id": self.user_id,
@@ -163,19 +196,6 @@ class House(BaseModel, db.Model):
         for facility in self.facilities:
             facilities.append(facility.id)
         house_dict["facilities"] = facilities
-
-        # 评论信息
-        comments = []
-        orders = Order.query.filter(Order.house_id == self.id, Order.status == "COMPLETE", Order.comment != None)\
-            .order_by(Order.update_time.desc()).limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)
-        for order in orders:
-            comment = {
-                "comment": order.comment,  # 评论的内容
-                "user_name": order.user.name if order.user.name != order.user.mobile else "匿名用户",  # 发表评论的用户
-                "ctime": order.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
-            }
-            comments.append(comment)
-        house_dict["comments"] = comments
         return house_dict
 
 
@@ -198,10 +218,26 @@ class HouseImage(BaseModel, db.Model):
     url = db.Column(db.String(256), nullable=False)  # 图片的路径
 
 
+class HousePriceCalendar(BaseModel, db.Model):
+    """房屋价格日历"""
+
+    __tablename__ = "ih_house_price_calendar"
+
+    house_id = db.Column(db.Integer, db.ForeignKey("ih_house_info.id"), primary_key=True)  # 房屋编号
+    start_date = db.Column(db.Date, nullable=False)  # 价格日历的起始日期
+    prices = db.Column(db.LargeBinary, nullable=False)  # 从起始日期开始每天的价格，int32数组，0表示使用房屋单价，单位：分
+
+
 class Order(BaseModel, db.Model):
     """订单"""
 
     __tablename__ = "ih_order_info"
+    __table_args__ = (
+        # 下单时检查同一房屋预订日期冲突的订单
+        db.Index("ix_ih_order_info_house_dates", "house_id", "begin_date", "end_date"),
+        # 用户订单列表按创建时间排序
+        db.Index("ix_ih_order_info_user_create_time", "user_id", "create_time"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)  # 订单编号
     user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False)  # 下订单的用户编号
@@ -224,6 +260,36 @@ class Order(BaseModel, db.Model):
         default="WAIT_ACCEPT", index=True)
     comment = db.Column(db.Text)  # 订单的评论信息或者拒单原因
 
+    @staticmethod
+    def list_query_options():
+        """
+        查询订单列表时使用的加载选项，配合to_dict使用，查询需要join订单对应的房屋
+        房屋只加载to_dict用到的字段，随订单一起查询，避免遍历订单时逐个懒加载house
+        """
+        return (
+            contains_eager("house").load_only("id", "title", "index_image_url"),
+        )
+
+    @staticmethod
+    def comments_query(house_id):
+        """
+        查询房屋评论信息，按评价时间和订单编号降序排序
+        评论用户通过join与订单一起查询，只加载用户名和手机号，避免遍历评论时逐个懒加载user
+        """
+        return Order.query.join(Order.user)\
+            .options(contains_eager("user").load_only("id", "name", "mobile"))\
+            .filter(Order.house_id == house_id, Order.status == "COMPLETE", Order.comment != None)\
+            .order_by(Order.update_time.desc(), Order.id.desc())
+
+    def to_comment_dict(self):
+        """将订单的评论信息转换为字典数据"""
+        comment_dict = {
+            "comment": self.comment,  # 评论的内容
+            "user_name": self.user.name if self.user.name != self.user.mobile else "匿名用户",  # 发表评论的用户
+            "ctime": self.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
+        }
+        return comment_dict
+
     def to_dict(self):
         """将订单信息转换为字典数据"""
         order_dict = {
@@ -0,0 +1,185 @@
+# -*- coding:utf-8 -*-
+
+import datetime
+
+from redis.exceptions import WatchError
+
+from ihome import db, redis_store
+from ihome.models import House, Order
+
+
+# 占用房屋日期的订单状态，已拒单和已取消的订单不再占用房屋
+BLOCKING_ORDER_STATUS = ("WAIT_ACCEPT", "WAIT_PAYMENT", "PAID", "WAIT_COMMENT", "COMPLETE")
+
+# 预订位图的起始日期，位图中的第n位表示起始日期后的第n天是否已被预订
+_EPOCH = datetime.date(2018, 1, 1)
+
+# 预订位图初始化完成的标记，未初始化或redis数据丢失时按日期筛选房屋仍然查询订单表
+BOOKED_READY_KEY = "house_booked_ready"
+
+
+def _booked_key(house_id):
+    """房屋预订位图在redis中的键"""
+    return "house_booked_%s" % house_id
+
+
+def _day_offset(day):
+    """日期在预订位图中的位置"""
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+    return max((day - _EPOCH).days, 0)
+
+
+def _has_booked_bit(data, lo, hi):
+    """
+    判断位图片段中[lo, hi]区间内是否有被置1的位
+    :param data: 从第 lo // 8 个字节开始截取的位图片段
+    """
+    first_bit = lo // 8 * 8
+    for offset in xrange(lo - first_bit, hi - first_bit + 1):
+        byte_index = offset // 8
+        if byte_index >= len(data):
+            break
+        # redis位图中每个字节的高位在前
+        if ord(data[byte_index]) & (0x80 >> (offset % 8)):
+            return True
+    return False
+
+
+def mark_booked(house_id, begin_date, end_date, pipe=None):
+    """
+    下单占用日期后，在房屋的预订位图中标记[begin_date, end_date]区间内的日期
+    :param pipe: 可传入外部的pipeline，由调用方统一执行
+    """
+    p = pipe if pipe is not None else redis_store.pipeline()
+    key = _booked_key(house_id)
+    for offset in xrange(_day_offset(begin_date), _day_offset(end_date) + 1):
+        p.setbit(key, offset, 1)
+    if pipe is None:
+        p.execute()
+
+
+def release_booked(house_id, begin_date, end_date):
+    """
+    拒单/取消后释放日期，按仍然占用房屋的订单重新计算[begin_date, end_date]区间内的位
+    1.WATCH房屋的预订位图，期间其他订单修改了位图时重新计算，不会清除其他订单刚标记的日期
+    2.使用新的数据库连接查询区间内占用房屋的订单，读取到WATCH之后已提交的订单
+    3.在事务中写入区间内的每一位
+    """
+    key = _booked_key(house_id)
+    lo, hi = _day_offset(begin_date), _day_offset(end_date)
+    orders = Order.__table__
+    query = db.select([orders.c.begin_date, orders.c.end_date]).where(db.and_(
+        orders.c.house_id == house_id,
+        orders.c.status.in_(BLOCKING_ORDER_STATUS),
+        orders.c.begin_date <= end_date,
+        orders.c.end_date >= begin_date))
+    with redis_store.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                connection = db.engine.connect()
+                try:
+                    rows = connection.execute(query).fetchall()
+                finally:
+                    connection.close()
+                booked = set()
+                for row in rows:
+                    booked.update(xrange(max(_day_offset(row.begin_date), lo), min(_day_offset(row.end_date), hi) + 1))
+                pipe.multi()
+                for offset in xrange(lo, hi + 1):
+                    pipe.setbit(key, offset, 1 if offset in booked else 0)
+                pipe.execute()
+                return
+            except WatchError:
+                continue
+
+
+def _queue_range_check(pipe, key, lo, hi):
+    """
+    在pipeline中加入判断位图[lo, hi]区间内是否有被置1的位的命令
+    首尾两个字节取出后逐位判断，中间的整字节交给bitcount统计，命令数与区间长度无关
+    """
+    lo_byte, hi_byte = lo // 8, hi // 8
+    pipe.getrange(key, lo_byte, lo_byte)
+    if hi_byte > lo_byte:
+        pipe.getrange(key, hi_byte, hi_byte)
+    if hi_byte - lo_byte >= 2:
+        pipe.bitcount(key, lo_byte + 1, hi_byte - 1)
+
+
+def _range_has_booked_bit(results, lo, hi):
+    """根据_queue_range_check加入的命令的执行结果，判断[lo, hi]区间内是否有被置1的位"""
+    lo_byte, hi_byte = lo // 8, hi // 8
+    if _has_booked_bit(results[0], lo, min(hi, lo_byte * 8 + 7)):
+        return True
+    if hi_byte > lo_byte and _has_booked_bit(results[1], hi_byte * 8, hi):
+        return True
+    return hi_byte - lo_byte >= 2 and results[2] > 0
+
+
+def get_booked_houses(house_ids, start_date=None, end_date=None):
+    """
+    从预订位图中查询在指定日期内已被预订的房屋，耗时只与候选房屋的数量有关
+    1.同时有开始和结束日期，或只有结束日期，判断区间内是否有被置1的位
+    2.只有开始日期，判断开始日期之后是否存在被置1的位
+    :param house_ids: 候选的房屋编号
+    :return: 存在日期冲突的房屋编号列表，预订位图未初始化时返回None，由调用方查询订单表
+    """
+    if not redis_store.exists(BOOKED_READY_KEY):
+        return None
+    if not house_ids:
+        return []
+    pipe = redis_store.pipeline(transaction=False)
+    booked_ids = []
+    if end_date is not None:
+        lo = _day_offset(start_date) if start_date else 0
+        hi = _day_offset(end_date)
+        for house_id in house_ids:
+            _queue_range_check(pipe, _booked_key(house_id), lo, hi)
+        results = pipe.execute()
+        # 每套房屋的命令数相同
+        step = len(results) // len(house_ids)
+        for index, house_id in enumerate(house_ids):
+            if _range_has_booked_bit(results[index * step:(index + 1) * step], lo, hi):
+                booked_ids.append(house_id)
+    else:
+        lo = _day_offset(start_date)
+        for house_id in house_ids:
+            # 开始日期所在的字节需要逐位判断，之后的字节交给bitpos查找
+            pipe.getrange(_booked_key(house_id), lo // 8, lo // 8)
+            pipe.bitpos(_booked_key(house_id), 1, lo // 8 + 1)
+        results = pipe.execute()
+        for index, house_id in enumerate(house_ids):
+            head, pos = results[index * 2], results[index * 2 + 1]
+            if _has_booked_bit(head, lo, lo // 8 * 8 + 7) or pos != -1:
+                booked_ids.append(house_id)
+    return booked_ids
+
+
+def conflict_orders_query(start_date=None, end_date=None, house_id=None):
+    """
+    查询在指定日期内占用房屋的订单的房屋编号
+    预订位图不可用时代替位图筛选房屋，下单时检查指定房屋的日期冲突
+    """
+    conflict_orders = Order.query.with_entities(Order.house_id).filter(Order.status.in_(BLOCKING_ORDER_STATUS))
+    if house_id is not None:
+        conflict_orders = conflict_orders.filter(Order.house_id == house_id)
+    if start_date:
+        conflict_orders = conflict_orders.filter(Order.end_date >= start_date)
+    if end_date:
+        conflict_orders = conflict_orders.filter(Order.begin_date <= end_date)
+    return conflict_orders
+
+
+def rebuild_booked_index():
+    """根据订单数据重建所有房屋的预订位图，用于上线初始化或redis数据丢失后的恢复"""
+    pipe = redis_store.pipeline()
+    for house in House.query.with_entities(House.id):
+        pipe.delete(_booked_key(house.id))
+    orders = Order.query.with_entities(Order.house_id, Order.begin_date, Order.end_date)\
+        .filter(Order.status.in_(BLOCKING_ORDER_STATUS))
+    for order in orders:
+        mark_booked(order.house_id, order.begin_date, order.end_date, pipe=pipe)
+    pipe.set(BOOKED_READY_KEY, 1)
+    pipe.execute()
@@ -0,0 +1,505 @@
+# -*- coding:utf-8 -*-
+
+import datetime
+import gzip
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from cStringIO import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from ihome import redis_store, constants
+
+
+# 只有持有锁的请求才能释放重建锁，避免锁过期后误删其他请求的锁
+_release_lock_script = redis_store.register_script("""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+""")
+
+# 后台刷新过期缓存的线程池
+_refresh_executor = ThreadPoolExecutor(max_workers=constants.CACHE_REFRESH_WORKERS)
+
+# 进程内缓存失效通知的频道
+_INVALIDATE_CHANNEL = "cache_invalidate"
+
+
+class LocalCache(object):
+    """进程内的LRU缓存，每条数据有独立的有效期，超过容量时淘汰最久未使用的数据"""
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """读取缓存，不存在或已过期时返回None"""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            value, expire_at = item
+            if time.time() >= expire_at:
+                return None
+            # 重新插入到末尾，表示最近使用过
+            self._data[key] = item
+            return value
+
+    def set(self, key, value, expires):
+        """写入缓存"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + expires)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """删除缓存"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+
+# 进程内缓存，放在redis前面，只用于城区、首页、房屋详情这类数据量小、读多写少的缓存
+_local_cache = LocalCache(constants.CACHE_LOCAL_MAX_SIZE)
+
+# 各层缓存的命中次数统计
+_stats = {"local_hit": 0, "local_miss": 0, "redis_hit": 0, "redis_miss": 0}
+_stats_lock = threading.Lock()
+
+# 各进程的命中次数定期累加到redis的hash中，用于统计所有进程的命中率
+CACHE_STATS_KEY = "cache_stats"
+
+# 尚未累加到redis中的命中次数，以及上次累加的时间
+_unflushed_stats = dict.fromkeys(_stats, 0)
+_stats_flushed_at = time.time()
+
+# 订阅失效通知的进程号，fork出的子进程需要重新订阅
+_subscriber_pid = None
+_subscriber_lock = threading.Lock()
+
+# 缓存数据的头部标记，格式为 cache|软过期时间戳|重建耗时|数据摘要|压缩数据长度\n缓存数据gzip压缩后的数据
+_HEADER = "cache|"
+
+
+class CachedValue(str):
+    """
+    从缓存读取或重建得到的数据，可以直接当作字符串使用
+    etag为数据的摘要，gzipped为gzip压缩后的数据，没有压缩时为None
+    """
+
+    def __new__(cls, value, etag=None, gzipped=None):
+        obj = str.__new__(cls, value)
+        obj.etag = etag if etag else hashlib.md5(value).hexdigest()
+        obj.gzipped = gzipped
+        return obj
+
+
+def _gzip(value):
+    """gzip压缩数据，固定修改时间，保证相同数据的压缩结果相同"""
+    out = StringIO()
+    with gzip.GzipFile(fileobj=out, mode="wb", mtime=0) as f:
+        f.write(value)
+    return out.getvalue()
+
+
+def jitter_expires(expires):
+    """为缓存有效期增加随机时长，避免同时写入的缓存在同一时刻集中过期"""
+    return expires + random.randint(0, int(expires * constants.CACHE_EXPIRES_JITTER))
+
+
+def _count(name, amount=1):
+    """累加缓存命中统计，距上次累加超过一定时间后把本进程新增的次数累加到redis中"""
+    global _stats_flushed_at
+    with _stats_lock:
+        _stats[name] += amount
+        _unflushed_stats[name] += amount
+        now = time.time()
+        if now - _stats_flushed_at < constants.CACHE_STATS_FLUSH_INTERVAL:
+            return
+        _stats_flushed_at = now
+        unflushed = dict(_unflushed_stats)
+        for stat_name in _unflushed_stats:
+            _unflushed_stats[stat_name] = 0
+    try:
+        pipe = redis_store.pipeline(transaction=False)
+        for stat_name, stat_amount in unflushed.items():
+            if stat_amount:
+                pipe.hincrby(CACHE_STATS_KEY, stat_name, stat_amount)
+        pipe.execute()
+    except Exception as e:
+        current_app.logger.error(e)
+
+
+def stats():
+    """获取当前进程各层缓存的命中统计"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def cluster_stats():
+    """获取所有进程累加到redis中的各层缓存命中统计"""
+    result = dict.fromkeys(_stats, 0)
+    for name, value in redis_store.hgetall(CACHE_STATS_KEY).items():
+        result[name] = int(value)
+    return result
+
+
+def _hot_keys_key(day):
+    """缓存访问次数统计的有序集合，每天一个"""
+    return "cache_hot_keys_%s" % day.strftime("%Y%m%d")
+
+
+def _record_access(key, field):
+    """按采样率记录缓存的访问次数，用于预热时找出热点缓存"""
+    if random.random() >= constants.CACHE_HOT_KEY_SAMPLE_RATE:
+        return
+    member = key if field is None else "%s|%s" % (key, field)
+    hot_keys_key = _hot_keys_key(datetime.date.today())
+    try:
+        pipe = redis_store.pipeline(transaction=False)
+        pipe.zincrby(hot_keys_key, member, 1)
+        pipe.expire(hot_keys_key, constants.CACHE_HOT_KEY_EXPIRES)
+        pipe.execute()
+    except Exception as e:
+        current_app.logger.error(e)
+
+
+def hot_keys(limit):
+    """
+    获取今天和昨天访问次数最多的缓存
+    :return: [(缓存的键, hash类型缓存的字段)]，按访问次数降序排列，字段为None表示不是hash类型
+    """
+    today = datetime.date.today()
+    days = (today, today - datetime.timedelta(days=1))
+    union_key = "cache_hot_keys_union_%s" % uuid.uuid4().hex
+    pipe = redis_store.pipeline()
+    pipe.zunionstore(union_key, [_hot_keys_key(day) for day in days])
+    pipe.zrevrange(union_key, 0, limit - 1)
+    pipe.delete(union_key)
+    members = pipe.execute()[1]
+    result = []
+    for member in members:
+        key, _, field = member.partition("|")
+        result.append((key, field or None))
+    return result
+
+
+def _listen_invalidation():
+    """在后台线程中订阅失效通知，收到通知后删除进程内缓存，连接断开后清空进程内缓存并重新订阅"""
+    while True:
+        try:
+            pubsub = redis_store.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_INVALIDATE_CHANNEL)
+            for message in pubsub.listen():
+                _local_cache.delete(message["data"])
+        except Exception:
+            # 断开期间可能错过失效通知
+            _local_cache.clear()
+            time.sleep(1)
+
+
+def _ensure_subscriber():
+    """当前进程还没有订阅失效通知时，启动订阅线程"""
+    global _subscriber_pid
+    if _subscriber_pid == os.getpid():
+        return
+    with _subscriber_lock:
+        if _subscriber_pid == os.getpid():
+            return
+        # fork出的子进程中继承的进程内缓存无法收到失效通知，需要清空
+        _local_cache.clear()
+        thread = threading.Thread(target=_listen_invalidation)
+        thread.daemon = True
+        thread.start()
+        _subscriber_pid = os.getpid()
+
+
+def invalidate(*keys):
+    """删除redis中的缓存，并通知所有进程删除进程内缓存"""
+    pipe = redis_store.pipeline()
+    pipe.delete(*keys)
+    for key in keys:
+        pipe.publish(_INVALIDATE_CHANNEL, key)
+    pipe.execute()
+    for key in keys:
+        _local_cache.delete(key)
+
+
+def _lock_key(key, field=None):
+    """缓存重建锁在redis中的键"""
+    if field is None:
+        return "lock_%s" % key
+    return "lock_%s_%s" % (key, field)
+
+
+def _pack(value, soft_expire_at, delta):
+    """在缓存数据前加上软过期时间、重建耗时、数据摘要和压缩数据长度，压缩数据放在最后"""
+    gzipped = value.gzipped or ""
+    return "%s%.3f|%.3f|%s|%d\n%s%s" % (_HEADER, soft_expire_at, delta, value.etag, len(gzipped), value, gzipped)
+
+
+def _unpack(raw):
+    """
+    拆分缓存数据
+    :return: (CachedValue, 软过期时间戳, 重建耗时)，没有软过期时间的缓存数据软过期时间为None
+    """
+    if not raw.startswith(_HEADER):
+        return CachedValue(raw), None, None
+    header, body = raw.split("\n", 1)
+    soft_expire_at, delta, etag, gzip_length = header[len(_HEADER):].split("|")
+    gzip_length = int(gzip_length)
+    if gzip_length:
+        value = CachedValue(body[:-gzip_length], etag, body[-gzip_length:])
+    else:
+        value = CachedValue(body, etag)
+    soft_expire_at = float(soft_expire_at)
+    return value, soft_expire_at if soft_expire_at else None, float(delta)
+
+
+def _need_refresh(soft_expire_at, delta):
+    """
+    判断缓存是否需要刷新，超过软过期时间一定刷新
+    未到软过期时间时按概率提前刷新，越接近过期、重建越耗时、读取越频繁的缓存越可能被提前刷新
+    """
+    now = time.time()
+    if now >= soft_expire_at:
+        return True
+    # 1 - random()的取值范围为(0, 1]，保证对数有意义
+    return now - delta * constants.CACHE_EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= soft_expire_at
+
+
+def _read(key, field=None):
+    """读取缓存，redis异常时视为未命中"""
+    try:
+        if field is None:
+            return redis_store.get(key)
+        return redis_store.hget(key, field)
+    except Exception as e:
+        current_app.logger.error(e)
+        return None
+
+
+def _pack_for_write(value, expires, serve_stale, delta):
+    """
+    计算写入redis的缓存数据和有效期
+    serve_stale为True时，缓存数据带上软过期时间，redis中的有效期再延长一段宽限期，宽限期内返回旧数据并在后台刷新
+    """
+    expires = jitter_expires(expires)
+    if serve_stale:
+        return _pack(value, time.time() + expires, delta), expires + constants.CACHE_STALE_GRACE_SECONDS
+    return _pack(value, 0, delta), expires
+
+
+def _write(key, value, expires, field=None, serve_stale=False, delta=0):
+    """写入缓存，hash类型的缓存使用事务同时设置字段和整个hash的有效期"""
+    packed, expires = _pack_for_write(value, expires, serve_stale, delta)
+    try:
+        if field is None:
+            redis_store.setex(key, expires, packed)
+        else:
+            pipe = redis_store.pipeline()
+            pipe.hset(key, field, packed)
+            pipe.expire(key, expires)
+            pipe.execute()
+    except Exception as e:
+        current_app.logger.error(e)
+
+
+def _rebuild_value(rebuild, compress):
+    """调用rebuild重建数据，计算数据摘要，需要时同时保存gzip压缩后的数据"""
+    value = rebuild()
+    if value is None:
+        return None
+    return CachedValue(value, gzipped=_gzip(value) if compress else None)
+
+
+def _rebuild_and_write(key, rebuild, expires, field, cacheable, serve_stale, local, compress):
+    """调用rebuild重建数据，并在允许时写入缓存"""
+    start = time.time()
+    value = _rebuild_value(rebuild, compress)
+    if value is not None and (cacheable is None or cacheable(value)):
+        _write(key, value, expires, field, serve_stale, time.time() - start)
+        if local:
+            # 通知其他进程丢弃旧的进程内缓存
+            try:
+                redis_store.publish(_INVALIDATE_CHANNEL, key)
+            except Exception as e:
+                current_app.logger.error(e)
+            _local_cache.set(key, value, constants.CACHE_LOCAL_EXPIRES)
+    return value
+
+
+def _release_lock(lock_key, token):
+    """释放缓存重建锁"""
+    try:
+        _release_lock_script(keys=[lock_key], args=[token])
+    except Exception as e:
+        current_app.logger.error(e)
+
+
+def _refresh_in_background(app, key, rebuild, expires, field, cacheable, local, compress, lock_key, token):
+    """在后台线程中刷新缓存，刷新完成后释放重建锁"""
+    with app.app_context():
+        try:
+            _rebuild_and_write(key, rebuild, expires, field, cacheable, True, local, compress)
+        except Exception as e:
+            current_app.logger.error(e)
+        finally:
+            _release_lock(lock_key, token)
+
+
+def _schedule_refresh(key, rebuild, expires, field, cacheable, local, compress):
+    """抢到重建锁后提交后台刷新任务，同一个缓存同一时间只有一个刷新任务"""
+    lock_key = _lock_key(key, field)
+    token = uuid.uuid4().hex
+    try:
+        if not redis_store.set(lock_key, token, nx=True, ex=constants.CACHE_REBUILD_LOCK_EXPIRES):
+            return
+    except Exception as e:
+        current_app.logger.error(e)
+        return
+    app = current_app._get_current_object()
+    _refresh_executor.submit(_refresh_in_background, app, key, rebuild, expires, field, cacheable, local, compress,
+                             lock_key, token)
+
+
+def get_many(keys, rebuild_many, expires, serve_stale=False, local=False):
+    """
+    批量读取缓存，与get_or_rebuild使用相同的缓存格式，可以共用同一批缓存
+    1.先读取进程内缓存，再使用mget一次读取redis中剩余的缓存
+    2.未命中的缓存调用一次rebuild_many重建，重建结果通过pipeline一次写回redis
+    3.超过软过期时间的缓存仍直接返回，由单个读取时在后台刷新
+    批量读取不使用重建锁，同一批缓存同时未命中时可能被重复重建
+    :param rebuild_many: 重建数据的函数，参数为未命中的键列表，返回{键: 需要缓存的字符串}，无数据的键不返回
+    :return: {键: CachedValue}，无数据的键不在结果中
+    """
+    values = {}
+    remaining = list(keys)
+    if local:
+        _ensure_subscriber()
+        remaining = []
+        for key in keys:
+            value = _local_cache.get(key)
+            if value is None:
+                remaining.append(key)
+            else:
+                values[key] = value
+        _count("local_hit", len(values))
+        _count("local_miss", len(remaining))
+    missing = []
+    if remaining:
+        try:
+            raws = redis_store.mget(remaining)
+        except Exception as e:
+            current_app.logger.error(e)
+            raws = [None] * len(remaining)
+        for key, raw in zip(remaining, raws):
+            if raw is None:
+                missing.append(key)
+                continue
+            values[key] = _unpack(raw)[0]
+            if local:
+                _local_cache.set(key, values[key], constants.CACHE_LOCAL_EXPIRES)
+    _count("redis_hit", len(remaining) - len(missing))
+    _count("redis_miss", len(missing))
+    if not missing:
+        return values
+
+    start = time.time()
+    rebuilt = rebuild_many(missing)
+    delta = time.time() - start
+    pipe = redis_store.pipeline(transaction=False)
+    for key, value in rebuilt.items():
+        value = CachedValue(value)
+        values[key] = value
+        packed, key_expires = _pack_for_write(value, expires, serve_stale, delta)
+        pipe.setex(key, key_expires, packed)
+        if local:
+            pipe.publish(_INVALIDATE_CHANNEL, key)
+            _local_cache.set(key, value, constants.CACHE_LOCAL_EXPIRES)
+    try:
+        pipe.execute()
+    except Exception as e:
+        current_app.logger.error(e)
+    return values
+
+
+def get_or_rebuild(key, rebuild, expires, field=None, cacheable=None, serve_stale=False, local=False,
+                   compress=False):
+    """
+    缓存--数据库--缓存，同一个缓存同一时间只允许一个请求重建
+    1.读取缓存，命中直接返回
+    2.未命中时使用set nx抢占该缓存的重建锁
+    3.抢到锁的请求调用rebuild重建数据并写入缓存，完成后释放锁
+    4.没抢到锁的请求短暂等待，期间重复读取缓存，读到即返回
+    5.等待超时后自行调用rebuild返回数据，但不写入缓存
+    serve_stale为True时使用stale-while-revalidate模式，缓存超过软过期时间后仍直接返回旧数据，
+    同时在后台线程中刷新缓存；未到软过期时间的缓存也会按概率提前刷新
+    local为True时先读取进程内缓存，进程内缓存的有效期较短，并通过redis的发布订阅在各进程间同步失效
+    :param rebuild: 重建数据的函数，返回需要缓存的字符串，返回None表示无数据，不写入缓存；
+                    serve_stale为True时可能在后台线程中调用，不能依赖请求上下文
+    :param expires: 缓存有效期，写入时会增加随机时长
+    :param field: 缓存为hash类型时的字段
+    :param cacheable: 判断重建结果能否写入缓存的函数，默认都写入
+    :param local: 是否使用进程内缓存，不支持hash类型的缓存
+    :param compress: 是否在缓存中同时保存gzip压缩后的数据，用于直接返回压缩的响应
+    :return: 缓存或重建的数据CachedValue，附带数据摘要和压缩数据，rebuild中的异常会直接抛出
+    """
+    _record_access(key, field)
+    if local:
+        _ensure_subscriber()
+        value = _local_cache.get(key)
+        if value is not None:
+            _count("local_hit")
+            return value
+        _count("local_miss")
+
+    raw = _read(key, field)
+    if raw is not None:
+        _count("redis_hit")
+        value, soft_expire_at, delta = _unpack(raw)
+        if soft_expire_at is not None and _need_refresh(soft_expire_at, delta):
+            _schedule_refresh(key, rebuild, expires, field, cacheable, local, compress)
+        elif local:
+            _local_cache.set(key, value, constants.CACHE_LOCAL_EXPIRES)
+        current_app.logger.info("hit redis %s" % key)
+        return value
+    _count("redis_miss")
+
+    lock_key = _lock_key(key, field)
+    token = uuid.uuid4().hex
+    try:
+        locked = redis_store.set(lock_key, token, nx=True, ex=constants.CACHE_REBUILD_LOCK_EXPIRES)
+    except Exception as e:
+        # redis不可用时直接查询数据库
+        current_app.logger.error(e)
+        return _rebuild_value(rebuild, compress)
+
+    if not locked:
+        # 其他请求正在重建，等待其写入缓存
+        deadline = time.time() + constants.CACHE_REBUILD_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(constants.CACHE_REBUILD_POLL_INTERVAL)
+            raw = _read(key, field)
+            if raw is not None:
+                current_app.logger.info("hit redis %s after waiting rebuild" % key)
+                return _unpack(raw)[0]
+        return _rebuild_value(rebuild, compress)
+
+    try:
+        return _rebuild_and_write(key, rebuild, expires, field, cacheable, serve_stale, local, compress)
+    finally:
+        _release_lock(lock_key, token)
@@ -6,14 +6,46 @@
 import random
 import string
 import os.path
+import time
 from cStringIO import StringIO
 
+import numpy as np
 from PIL import Image
 from PIL import ImageFilter
 from PIL.ImageDraw import Draw
 from PIL.ImageFont import truetype
 
 
+# loaded fonts, keyed by (path, size)
+_font_cache = {}
+# pre-rasterized glyph coverage masks ('L' images), keyed by (path, size, char)
+_glyph_cache = {}
+
+
+def load_font(name, size):
+    """ Returns the font for (name, size), loading it only once per process
+    """
+    try:
+        return _font_cache[(name, size)]
+    except KeyError:
+        font = _font_cache[(name, size)] = truetype(name, size)
+        return font
+
+
+def load_glyph(name, size, char):
+    """ Returns the cropped coverage mask of a character, rendered only once per process
+    """
+    key = (name, size, char)
+    try:
+        return _glyph_cache[key]
+    except KeyError:
+        font = load_font(name, size)
+        glyph = Image.new('L', font.getsize(char), 0)
+        Draw(glyph).text((0, 0), char, font=font, fill=255)
+        glyph = _glyph_cache[key] = glyph.crop(glyph.getbbox())
+        return glyph
+
+
 class Bezier:
     def __init__(self):
         self.tsequence = tuple([t / 20.0 for t in range(21)])
@@ -66,14 +98,8 @@ class Captcha(object):
             Captcha._instance = Captcha()
         return Captcha._instance
 
-    def initialize(self, width=200, height=75, color=None, text=None, fonts=None):
-        # self.image = Image.new('RGB', (width, height), (255, 255, 255))
-        self._text = text if text else random.sample(string.uppercase + string.uppercase + '3456789', 4)
-        self.fonts = fonts if fonts else \
-            [os.path.join(self._dir, 'fonts', font) for font in ['Arial.ttf', 'Georgia.ttf', 'actionj.ttf']]
-        self.width = width
-        self.height = height
-        self._color = color if color else self.random_color(0, 200, random.randint(220, 255))
+    def default_fonts(self):
+        return [os.path.join(self._dir, 'fonts', font) for font in ['Arial.ttf', 'Georgia.ttf', 'actionj.ttf']]
 
     @staticmethod
     def random_color(start, end, opacity=None):
@@ -94,46 +120,39 @@ class Captcha(object):
     def smooth(image):
         return image.filter(ImageFilter.SMOOTH)
 
-    def curve(self, image, width=4, number=6, color=None):
+    def curve(self, image, color, width=4, number=6):
         dx, height = image.size
         dx /= number
-        path = [(dx * i, random.randint(0, height))
-                for i in xrange(1, number)]
-        bcoefs = self._bezier.make_bezier(number - 1)
-        points = []
-        for coefs in bcoefs:
-            points.append(tuple(sum([coef * p for coef, p in zip(coefs, ps)])
-                                for ps in zip(*path)))
-        Draw(image).line(points, fill=color if color else self._color, width=width)
+        path = np.array([(dx * i, random.randint(0, height))
+                         for i in xrange(1, number)], dtype=float)
+        bcoefs = np.array(self._bezier.make_bezier(number - 1))
+        # every point of the curve is a weighted sum of the control points
+        points = [tuple(point) for point in np.dot(bcoefs, path)]
+        Draw(image).line(points, fill=color, width=width)
         return image
 
-    def noise(self, image, number=50, level=2, color=None):
+    def noise(self, image, color, number=50, level=2):
         width, height = image.size
         dx = width / 10
-        width -= dx
         dy = height / 10
-        height -= dy
-        draw = Draw(image)
-        for i in xrange(number):
-            x = int(random.uniform(dx, width))
-            y = int(random.uniform(dy, height))
-            draw.line(((x, y), (x + level, y)), fill=color if color else self._color, width=level)
-        return image
+        xs = np.random.randint(dx, width - dx, number)
+        ys = np.random.randint(dy, height - dy, number)
+        # each dot is a short horizontal line, level pixels thick and level + 1 pixels long
+        rows = ys[:, np.newaxis, np.newaxis] + (np.arange(level) - level // 2)[np.newaxis, :, np.newaxis]
+        cols = xs[:, np.newaxis, np.newaxis] + np.arange(level + 1)[np.newaxis, np.newaxis, :]
+        rows, cols = np.broadcast_arrays(np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1))
+        pixels = np.array(image)
+        pixels[rows, cols] = color[:3]
+        return Image.fromarray(pixels)
 
-    def text(self, image, fonts, font_sizes=None, drawings=None, squeeze_factor=0.75, color=None):
-        color = color if color else self._color
-        fonts = tuple([truetype(name, size)
-                       for name in fonts
-                       for size in font_sizes or (65, 70, 75)])
-        draw = Draw(image)
+    def text(self, image, chars, fonts, color, font_sizes=None, drawings=None, squeeze_factor=0.75):
+        font_keys = [(name, size)
+                     for name in fonts
+                     for size in font_sizes or (65, 70, 75)]
         char_images = []
-        for c in self._text:
-            font = random.choice(fonts)
-            c_width, c_height = draw.textsize(c, font=font)
-            char_image = Image.new('RGB', (c_width, c_height), (0, 0, 0))
-            char_draw = Draw(char_image)
-            char_draw.text((0, 0), c, font=font, fill=color)
-            char_image = char_image.crop(char_image.getbbox())
+        for c in chars:
+            name, size = random.choice(font_keys)
+            char_image = load_glyph(name, size, c)
             for drawing in drawings:
                 d = getattr(self, drawing)
                 char_image = d(char_image)
@@ -142,12 +161,18 @@ class Captcha(object):
         offset = int((width - sum(int(i.size[0] * squeeze_factor)
                                   for i in char_images[:-1]) -
                       char_images[-1].size[0]) / 2)
+        # the glyphs are coverage masks, scale them by the luminance of the text color
+        # so the text keeps the same opacity as when it was rendered in color
+        red, green, blue = color[:3]
+        factor = (0.299 * red + 0.587 * green + 0.114 * blue) * 1.97 / 255
+        fill = color[:3]
         for char_image in char_images:
             c_width, c_height = char_image.size
-            mask = char_image.convert('L').point(lambda i: i * 1.97)
-            image.paste(char_image,
-                        (offset, int((height - c_height) / 2)),
-                        mask)
+            mask = np.clip(np.asarray(char_image, dtype=np.float32) * factor, 0, 255).astype(np.uint8)
+            image.paste(fill,
+                        (offset, int((height - c_height) / 2),
+                         offset + c_width, int((height - c_height) / 2) + c_height),
+                        Image.fromarray(mask, 'L'))
             offset += int(c_width * squeeze_factor)
         return image
 
@@ -161,7 +186,7 @@ class Captcha(object):
         y1 = int(random.uniform(-dy, dy))
         x2 = int(random.uniform(-dx, dx))
         y2 = int(random.uniform(-dy, dy))
-        image2 = Image.new('RGB',
+        image2 = Image.new(image.mode,
                            (width + abs(x1) + abs(x2),
                             height + abs(y1) + abs(y2)))
         image2.paste(image, (abs(x1), abs(y1)))
@@ -178,7 +203,7 @@ class Captcha(object):
         width, height = image.size
         dx = int(random.random() * width * dx_factor)
         dy = int(random.random() * height * dy_factor)
-        image2 = Image.new('RGB', (width + dx, height + dy))
+        image2 = Image.new(image.mode, (width + dx, height + dy))
         image2.paste(image, (dx, dy))
         return image2
 
@@ -187,10 +212,17 @@ class Captcha(object):
         return image.rotate(
             random.uniform(-angle, angle), Image.BILINEAR, expand=1)
 
-    def captcha(self, path=None, fmt='JPEG'):
+    def captcha(self, chars, color, fonts, width=200, height=75, path=None, fmt='JPEG'):
         """Create a captcha.
 
+        All per-captcha state is passed in and kept in locals, so one
+        instance can be shared by concurrent threads.
+
         Args:
+            chars: the characters to draw.
+            color: text color, (red, green, blue, opacity).
+            fonts: font paths, one is picked at random for every character.
+            width, height: image size.
             path: save path, default None.
             fmt: image format, PNG / JPEG.
         Returns:
@@ -199,25 +231,108 @@ class Captcha(object):
                 ('fXZJN4AFxHGoU5mIlcsdOypa', 'JGW9', '\x89PNG\r\n\x1a\n\x00\x00\x00\r...')
 
         """
-        image = Image.new('RGB', (self.width, self.height), (255, 255, 255))
+        image = Image.new('RGB', (width, height), (255, 255, 255))
         image = self.background(image)
-        image = self.text(image, self.fonts, drawings=['warp', 'rotate', 'offset'])
-        image = self.curve(image)
-        image = self.noise(image)
+        image = self.text(image, chars, fonts, color, drawings=['warp', 'rotate', 'offset'])
+        image = self.curve(image, color)
+        image = self.noise(image, color)
         image = self.smooth(image)
         name = "".join(random.sample(string.lowercase + string.uppercase + '3456789', 24))
-        text = "".join(self._text)
+        text = "".join(chars)
         out = StringIO()
         image.save(out, format=fmt)
         if path:
             image.save(os.path.join(path, name), fmt)
         return name, text, out.getvalue()
 
-    def generate_captcha(self):
-        self.initialize()
-        return self.captcha("")
+    def generate_captcha(self, width=200, height=75, color=None, text=None, fonts=None):
+        """Create a random captcha, safe to call from concurrent threads.
+
+        Returns:
+            A tuple, (name, text, image data), see captcha().
+        """
+        chars = text if text else random.sample(string.uppercase + string.uppercase + '3456789', 4)
+        color = color if color else self.random_color(0, 200, random.randint(220, 255))
+        return self.captcha(chars, color, fonts if fonts else self.default_fonts(), width, height)
 
 captcha = Captcha.instance()
 
+
+def generate_captcha(**kwargs):
+    """Reentrant module level shortcut for Captcha.generate_captcha()"""
+    return captcha.generate_captcha(**kwargs)
+
+
+def _legacy_captcha(chars, color, fonts, width=200, height=75, fmt='JPEG'):
+    """ The renderer this module used before fonts and glyphs were cached and the
+        effects moved to NumPy, kept only as the baseline for benchmark()
+    """
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    image = captcha.background(image)
+
+    # text: fonts loaded per captcha, RGB char images, point() lambda for the mask
+    fonts = tuple([truetype(name, size) for name in fonts for size in (65, 70, 75)])
+    draw = Draw(image)
+    char_images = []
+    for c in chars:
+        font = random.choice(fonts)
+        c_width, c_height = draw.textsize(c, font=font)
+        char_image = Image.new('RGB', (c_width, c_height), (0, 0, 0))
+        Draw(char_image).text((0, 0), c, font=font, fill=color)
+        char_image = char_image.crop(char_image.getbbox())
+        for drawing in (captcha.warp, captcha.rotate, captcha.offset):
+            char_image = drawing(char_image)
+        char_images.append(char_image)
+    offset = int((width - sum(int(i.size[0] * 0.75) for i in char_images[:-1]) -
+                  char_images[-1].size[0]) / 2)
+    for char_image in char_images:
+        c_width, c_height = char_image.size
+        mask = char_image.convert('L').point(lambda i: i * 1.97)
+        image.paste(char_image, (offset, int((height - c_height) / 2)), mask)
+        offset += int(c_width * 0.75)
+
+    # curve: control points summed in Python
+    number = 6
+    dx = width / number
+    path = [(dx * i, random.randint(0, height)) for i in xrange(1, number)]
+    points = [tuple(sum([coef * p for coef, p in zip(coefs, ps)]) for ps in zip(*path))
+              for coefs in captcha._bezier.make_bezier(number - 1)]
+    Draw(image).line(points, fill=color, width=4)
+
+    # noise: one draw.line() call per dot
+    draw = Draw(image)
+    for i in xrange(50):
+        x = int(random.uniform(width / 10, width - width / 10))
+        y = int(random.uniform(height / 10, height - height / 10))
+        draw.line(((x, y), (x + 2, y)), fill=color, width=2)
+
+    image = captcha.smooth(image)
+    out = StringIO()
+    image.save(out, format=fmt)
+    return out.getvalue()
+
+
+def benchmark(number=200):
+    """ Measures captchas per second of the legacy renderer and the current one,
+        both drawing the same random texts and colors
+    """
+    fonts = captcha.default_fonts()
+    samples = [(random.sample(string.uppercase + string.uppercase + '3456789', 4),
+                captcha.random_color(0, 200, random.randint(220, 255)))
+               for _ in xrange(number)]
+
+    def run(render):
+        start = time.time()
+        for chars, color in samples:
+            render(chars, color)
+        return number / (time.time() - start)
+
+    before = run(lambda chars, color: _legacy_captcha(chars, color, fonts))
+    after = run(lambda chars, color: captcha.captcha(chars, color, fonts))
+    print "legacy renderer: %.1f captchas/s" % before
+    print "current renderer: %.1f captchas/s" % after
+    print "speedup: %.2fx" % (after / before)
+
+
 if __name__ == '__main__':
-    print captcha.generate_captcha()
+    benchmark()
@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+
+import time
+
+from flask import current_app
+
+from ihome import redis_store, constants
+from ihome.utils import captcha_render
+
+
+# 预先生成的图片验证码池，列表中每一项为"验证码文字\n图片数据"，从左侧放入，从右侧取出
+CAPTCHA_POOL_KEY = "captcha_pool"
+
+# 验证码池的统计信息，produced为生成数，requested为请求取出数，empty为池中没有验证码时同步生成的次数
+CAPTCHA_POOL_STATS_KEY = "captcha_pool_stats"
+
+
+def _generate():
+    """生成一个图片验证码"""
+    name, text, image = captcha_render.render()
+    return text, image
+
+
+def pop_captcha():
+    """
+    从验证码池中取出一个图片验证码，每个验证码只会被取出一次
+    池中没有验证码或redis异常时同步生成
+    :return: (验证码文字, 图片数据)
+    """
+    try:
+        pipe = redis_store.pipeline()
+        pipe.rpop(CAPTCHA_POOL_KEY)
+        pipe.hincrby(CAPTCHA_POOL_STATS_KEY, "requested", 1)
+        item = pipe.execute()[0]
+    except Exception as e:
+        current_app.logger.error(e)
+        return _generate()
+    if item is None:
+        try:
+            redis_store.hincrby(CAPTCHA_POOL_STATS_KEY, "empty", 1)
+        except Exception as e:
+            current_app.logger.error(e)
+        return _generate()
+    text, image = item.split("\n", 1)
+    return text, image
+
+
+def fill_pool():
+    """
+    补充验证码池，每次最多生成一批，池中的数量不超过上限
+    :return: 本次生成的验证码数量
+    """
+    count = min(constants.CAPTCHA_POOL_SIZE - redis_store.llen(CAPTCHA_POOL_KEY),
+                constants.CAPTCHA_POOL_BATCH_SIZE)
+    if count <= 0:
+        return 0
+    items = ["%s\n%s" % _generate() for _ in xrange(count)]
+    pipe = redis_store.pipeline()
+    pipe.lpush(CAPTCHA_POOL_KEY, *items)
+    # 多个生成进程同时补充时，丢弃超出上限的最早生成的验证码
+    pipe.ltrim(CAPTCHA_POOL_KEY, 0, constants.CAPTCHA_POOL_SIZE - 1)
+    pipe.hincrby(CAPTCHA_POOL_STATS_KEY, "produced", count)
+    pipe.execute()
+    return count
+
+
+def run_producer():
+    """后台持续补充验证码池，池满时等待一段时间再检查"""
+    while True:
+        try:
+            count = fill_pool()
+        except Exception as e:
+            current_app.logger.error(e)
+            count = 0
+        if count < constants.CAPTCHA_POOL_BATCH_SIZE:
+            time.sleep(constants.CAPTCHA_POOL_REFILL_INTERVAL)
+
+
+def pool_stats():
+    """获取验证码池的当前数量和累计的生成、请求取出、池空次数"""
+    pipe = redis_store.pipeline()
+    pipe.llen(CAPTCHA_POOL_KEY)
+    pipe.hgetall(CAPTCHA_POOL_STATS_KEY)
+    depth, counters = pipe.execute()
+    stats = {"depth": depth, "produced": 0, "requested": 0, "empty": 0}
+    for name, value in counters.items():
+        stats[name] = int(value)
+    return stats
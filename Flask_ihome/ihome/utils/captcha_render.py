@@ -0,0 +1,138 @@
+# -*- coding:utf-8 -*-
+
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+
+from ihome import constants
+from ihome.utils.captcha.captcha import generate_captcha
+
+
+# 渲染图片验证码的进程池，fork出的子进程中需要重新创建
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# 限制提交到进程池中等待渲染的验证码数量
+_pending = threading.BoundedSemaphore(constants.CAPTCHA_PROCESS_POOL_MAX_PENDING)
+
+
+def _get_executor():
+    """获取当前进程的渲染进程池，不存在时创建"""
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ProcessPoolExecutor(max_workers=constants.CAPTCHA_PROCESS_POOL_WORKERS)
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _reset_executor(broken):
+    """子进程异常退出后进程池不再可用，丢弃后下次获取时重新创建"""
+    global _executor_pid
+    with _executor_lock:
+        if _executor is broken:
+            _executor_pid = None
+    broken.shutdown(wait=False)
+
+
+def _submit():
+    """提交渲染任务，进程池不可用时重新创建进程池后再提交一次"""
+    executor = _get_executor()
+    try:
+        return executor.submit(generate_captcha)
+    except RuntimeError:
+        _reset_executor(executor)
+        return _get_executor().submit(generate_captcha)
+
+
+def render_in_pool():
+    """
+    在进程池中渲染图片验证码，渲染不占用当前进程的GIL
+    等待渲染的验证码超过上限时抛出RuntimeError，渲染超时抛出TimeoutError
+    超时的渲染在子进程中仍会执行完，执行完之前继续占用等待数量
+    :return: (name, text, image)
+    """
+    if not _pending.acquire(False):
+        raise RuntimeError("captcha process pool is busy")
+    try:
+        future = _submit()
+    except Exception:
+        _pending.release()
+        raise
+    # 渲染完成、失败或被取消后才释放占用的数量
+    future.add_done_callback(lambda f: _pending.release())
+    try:
+        return future.result(timeout=constants.CAPTCHA_PROCESS_POOL_TIMEOUT)
+    except Exception:
+        # 还在排队的任务直接取消，已经开始的渲染无法中止
+        future.cancel()
+        raise
+
+
+def render(use_pool=None):
+    """
+    渲染图片验证码，配置CAPTCHA_PROCESS_POOL为True时使用进程池渲染
+    进程池繁忙、超时或异常时在当前进程中渲染
+    :return: (name, text, image)
+    """
+    if use_pool is None:
+        use_pool = current_app.config.get("CAPTCHA_PROCESS_POOL", False)
+    if use_pool:
+        try:
+            return render_in_pool()
+        except Exception as e:
+            current_app.logger.error(e)
+    return generate_captcha()
+
+
+def benchmark(duration=5, threads=8):
+    """
+    对比在当前进程中渲染和使用进程池渲染时的吞吐量
+    多个线程持续请求验证码，同时另一个线程执行json序列化模拟其他请求，
+    分别统计验证码的生成速率和其他请求的执行速率
+    """
+    def run(render_func):
+        stop = time.time() + duration
+        counts = {"captcha": 0, "other": 0}
+        lock = threading.Lock()
+
+        def captcha_worker():
+            while time.time() < stop:
+                try:
+                    render_func()
+                except RuntimeError:
+                    # 进程池繁忙时稍后重试
+                    time.sleep(0.001)
+                    continue
+                with lock:
+                    counts["captcha"] += 1
+
+        def other_worker():
+            data = {"houses": [{"house_id": i, "title": "house %s" % i} for i in xrange(20)]}
+            while time.time() < stop:
+                json.dumps(data)
+                counts["other"] += 1
+
+        workers = [threading.Thread(target=captcha_worker) for _ in xrange(threads)]
+        workers.append(threading.Thread(target=other_worker))
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return counts["captcha"] / float(duration), counts["other"] / float(duration)
+
+    # 预先启动进程池中的进程，不计入统计时间
+    render_in_pool()
+    for name, render_func in (("in-process", generate_captcha), ("process pool", render_in_pool)):
+        captchas, others = run(render_func)
+        print "%s: %.1f captchas/s, %.0f other requests/s" % (name, captchas, others)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,8 +1,9 @@
 # -*- coding:utf-8 -*-
 
 import functools
+import hashlib
 
-from flask import g, session, jsonify
+from flask import g, session, jsonify, request, make_response
 from werkzeug.routing import BaseConverter
 from ihome.utils.response_code import RET
 
@@ -27,3 +28,27 @@ def login_required(f):
     return wrapper
 
 
+def make_cached_response(body, etag=None, gzipped=None):
+    """
+    构造缓存数据的响应，支持协商缓存和gzip压缩
+    1.请求头If-None-Match与etag一致时返回304，不返回响应体
+    2.客户端支持gzip且有压缩好的数据时直接返回压缩数据，不需要每次请求重新压缩
+    :param body: 响应体，从缓存中读取的CachedValue自带etag和gzipped
+    :param etag: 不传时使用body自带的摘要，没有时计算响应体的摘要
+    :param gzipped: 不传时使用body自带的压缩数据
+    """
+    if etag is None:
+        etag = getattr(body, "etag", None) or hashlib.md5(body).hexdigest()
+    if gzipped is None:
+        gzipped = getattr(body, "gzipped", None)
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+    elif gzipped and request.accept_encodings["gzip"]:
+        response = make_response(gzipped)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = make_response(str(body))
+    if gzipped:
+        response.vary.add("Accept-Encoding")
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,38 @@
+# -*- coding:utf-8 -*-
+
+from sqlalchemy import func
+
+from ihome import db, redis_store, constants
+from ihome.models import House
+from ihome.utils import cache
+
+
+def _count_key(area_id):
+    """房屋总数缓存在redis中的键，每个区域一个hash，字段为日期条件，area_id为空表示全部区域"""
+    return "houses_count_%s" % (area_id or "all")
+
+
+def get_houses_count(params_filter, area_id, start_date_str, end_date_str):
+    """
+    获取筛选条件下的房屋总数，与排序方式和页数无关，同一区域和日期条件的各排序方式、各页共用一个缓存
+    配置了HOUSE_LIST_COUNT_LIMIT时最多只统计到上限，超过上限的结果集返回近似的总数
+    :param params_filter: 房屋列表的过滤条件
+    :return: (房屋总数, 是否为近似值)
+    """
+    def rebuild():
+        house_ids = House.query.with_entities(House.id).filter(*params_filter)
+        if constants.HOUSE_LIST_COUNT_LIMIT:
+            # 多统计一条用于判断是否超过上限
+            house_ids = house_ids.limit(constants.HOUSE_LIST_COUNT_LIMIT + 1)
+        return str(db.session.query(func.count()).select_from(house_ids.subquery()).scalar())
+
+    count = int(cache.get_or_rebuild(_count_key(area_id), rebuild, constants.HOUSE_LIST_COUNT_REDIS_EXPIRES,
+                                     field="%s_%s" % (start_date_str, end_date_str)))
+    if constants.HOUSE_LIST_COUNT_LIMIT and count > constants.HOUSE_LIST_COUNT_LIMIT:
+        return constants.HOUSE_LIST_COUNT_LIMIT, True
+    return count, False
+
+
+def invalidate_houses_count(area_id):
+    """区域内的房屋或订单变化后，删除该区域和全部区域的房屋总数缓存"""
+    redis_store.delete(_count_key(area_id), _count_key(None))
@@ -0,0 +1,41 @@
+# -*- coding:utf-8 -*-
+
+from ihome import redis_store, constants
+from ihome.utils import cache
+
+
+def _index_key(area_id):
+    """记录区域内房屋列表页缓存键的集合，area_id为空表示全部区域"""
+    return "houses_keys_%s" % (area_id or "all")
+
+
+def record_key(area_id, key):
+    """写入房屋列表页缓存时记录缓存的键，集合的有效期不短于其中的缓存"""
+    pipe = redis_store.pipeline()
+    pipe.sadd(_index_key(area_id), key)
+    pipe.expire(_index_key(area_id), constants.HOUSE_LIST_REDIS_EXPIRES + constants.CACHE_STALE_GRACE_SECONDS)
+    pipe.execute()
+
+
+def invalidate_house_lists(area_id, sort_key=None):
+    """
+    删除区域和全部区域的房屋列表页缓存，不需要扫描整个redis
+    :param sort_key: 只删除该排序方式的列表页，为None时删除所有排序方式
+    """
+    index_keys = (_index_key(area_id), _index_key(None))
+    pipe = redis_store.pipeline()
+    for index_key in index_keys:
+        pipe.smembers(index_key)
+    members = pipe.execute()
+    pipe = redis_store.pipeline()
+    keys = set()
+    for index_key, index_members in zip(index_keys, members):
+        # 缓存键的最后一段为排序方式
+        if sort_key is not None:
+            index_members = [key for key in index_members if key.endswith("_%s" % sort_key)]
+        if index_members:
+            pipe.srem(index_key, *index_members)
+            keys.update(index_members)
+    if keys:
+        pipe.execute()
+        cache.invalidate(*keys)
@@ -0,0 +1,219 @@
+# -*- coding:utf-8 -*-
+
+import datetime
+import json
+import time
+
+from ihome import redis_store, constants
+from ihome.models import House
+from ihome.utils import pagination
+from ihome.utils.cache import jitter_expires
+
+
+# 房屋列表页的排序方式对应的有序集合，sort_key: (有序集合名称, 是否降序)，默认按房屋发布时间最新排序
+RANK_ORDERINGS = {
+    "new": ("new", True),
+    "booking": ("booking", True),
+    "price-inc": ("price", False),
+    "price-des": ("price", True),
+}
+
+# 有序集合初始化完成的标记，未初始化时房屋列表页仍然查询mysql
+# 成员改为补零的房屋编号后更换标记，旧格式的有序集合重建之前不再使用
+RANK_READY_KEY = "houses_rank_ready_v2"
+
+# 首页幻灯片的有序集合，只包含设置了主图片的房屋，分值为成交次数
+HOME_RANK_KEY = "houses_rank_home"
+
+
+# 按游标取下一页，分值相同的成员按成员字符串排序，用二分查找定位游标之后的第一个成员，只读不写
+_range_after_script = redis_store.register_script("""
+local key = KEYS[1]
+local score = ARGV[1]
+local member = ARGV[2]
+local count = tonumber(ARGV[3])
+local desc = ARGV[4] == '1'
+local lo, range_cmd
+if desc then
+    lo = redis.call('zcount', key, '(' .. score, '+inf')
+    range_cmd = 'zrevrange'
+else
+    lo = redis.call('zcount', key, '-inf', '(' .. score)
+    range_cmd = 'zrange'
+end
+local hi = lo + redis.call('zcount', key, score, score)
+while lo < hi do
+    local mid = math.floor((lo + hi) / 2)
+    local m = redis.call(range_cmd, key, mid, mid)[1]
+    if (desc and m < member) or (not desc and m > member) then
+        hi = mid
+    else
+        lo = mid + 1
+    end
+end
+return redis.call(range_cmd, key, lo, lo + count - 1, 'WITHSCORES')
+""")
+
+
+def _member(house_id):
+    """
+    房屋在有序集合中的成员，分值相同时redis按成员字符串排序，
+    房屋编号补零后字符串顺序与数字顺序一致，与mysql中按房屋编号排序的结果相同
+    """
+    return "%010d" % int(house_id)
+
+
+def _rank_key(area_id, rank_name):
+    """有序集合在redis中的键，area_id为空表示全部区域"""
+    return "houses_rank_%s_%s" % (area_id or "all", rank_name)
+
+
+def _fragment_key(house_id):
+    """房屋基本信息片段在redis中的键"""
+    return "house_basic_%s" % house_id
+
+
+def _house_scores(house):
+    """房屋在各个有序集合中的分值"""
+    return {
+        "new": time.mktime(house.create_time.timetuple()),
+        "booking": house.order_count or 0,
+        "price": house.price or 0,
+    }
+
+
+def _cursor_value(rank_name, score):
+    """将有序集合中的分值转换为与mysql游标分页一致的排序字段值"""
+    if rank_name == "new":
+        return datetime.datetime.fromtimestamp(score).strftime('%Y-%m-%d %H:%M:%S')
+    return int(score)
+
+
+def _cursor_score(sort_value):
+    """将游标中的排序字段值转换为有序集合中的分值，与_house_scores的计算方式一致"""
+    if isinstance(sort_value, datetime.datetime):
+        return time.mktime(sort_value.timetuple())
+    return float(sort_value)
+
+
+def add_house(house, pipe=None):
+    """将房屋加入所属区域和全部区域的有序集合中，设置了主图片的房屋同时加入首页幻灯片的有序集合"""
+    p = pipe if pipe is not None else redis_store.pipeline()
+    scores = _house_scores(house)
+    for rank_name, score in scores.items():
+        for area_id in (house.area_id, None):
+            p.zadd(_rank_key(area_id, rank_name), score, _member(house.id))
+    if house.index_image_url:
+        p.zadd(HOME_RANK_KEY, scores["booking"], _member(house.id))
+    if pipe is None:
+        p.execute()
+
+
+def delete_fragment(house_id):
+    """房屋基本信息变化后删除对应的片段，下次读取时重建"""
+    redis_store.delete(_fragment_key(house_id))
+
+
+def get_fragments(house_ids):
+    """
+    批量获取房屋基本信息的json片段
+    1.使用mget一次取出所有片段
+    2.缺失的片段使用一次查询重建，通过pipeline写回redis
+    :return: 与house_ids顺序一致的json字符串列表，已不存在的房屋会被跳过
+    """
+    if not house_ids:
+        return []
+    fragments = dict(zip(house_ids, redis_store.mget([_fragment_key(house_id) for house_id in house_ids])))
+    missing_ids = [house_id for house_id in house_ids if fragments[house_id] is None]
+    if missing_ids:
+        pipe = redis_store.pipeline()
+        for house in House.query.options(*House.basic_query_options()).filter(House.id.in_(missing_ids)):
+            fragment = json.dumps(house.to_basic_dict())
+            fragments[house.id] = fragment
+            pipe.setex(_fragment_key(house.id), jitter_expires(constants.HOUSE_BASIC_REDIS_EXPIRES), fragment)
+        pipe.execute()
+    return [fragments[house_id] for house_id in house_ids if fragments[house_id] is not None]
+
+
+def get_home_houses():
+    """
+    获取首页幻灯片的房屋，按成交次数从有序集合中取出，不需要查询mysql
+    :return: 房屋基本信息json片段列表，有序集合未初始化时返回None
+    """
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.exists(RANK_READY_KEY)
+    pipe.zrevrange(HOME_RANK_KEY, 0, constants.HOME_PAGE_MAX_HOUSES - 1)
+    ready, members = pipe.execute()
+    if not ready:
+        return None
+    return get_fragments([int(member) for member in members])
+
+
+def get_houses_page(area_id, sort_key, page):
+    """
+    按页数从有序集合中获取房屋列表
+    :return: (房屋基本信息json片段列表, 总页数)，有序集合未初始化时返回None
+    """
+    if page < 1:
+        return None
+    rank_name, desc = RANK_ORDERINGS.get(sort_key, RANK_ORDERINGS["new"])
+    key = _rank_key(area_id, rank_name)
+    start = (page - 1) * constants.HOUSE_LIST_PAGE_CAPACITY
+    end = start + constants.HOUSE_LIST_PAGE_CAPACITY - 1
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.exists(RANK_READY_KEY)
+    pipe.zcard(key)
+    if desc:
+        pipe.zrevrange(key, start, end)
+    else:
+        pipe.zrange(key, start, end)
+    ready, total, members = pipe.execute()
+    if not ready:
+        return None
+    total_page = (total + constants.HOUSE_LIST_PAGE_CAPACITY - 1) // constants.HOUSE_LIST_PAGE_CAPACITY
+    return get_fragments([int(member) for member in members]), total_page
+
+
+def get_houses_after(area_id, sort_key, after=None):
+    """
+    按游标从有序集合中获取房屋列表，从游标中的(排序字段值, 房屋编号)之后开始读取
+    与mysql的游标分页一致，上一页最后一套房屋的分值变化后不会重复或跳过其他房屋
+    :param after: 上一页最后一套房屋的(排序字段值, 房屋编号)，None表示第一页
+    :return: (房屋基本信息json片段列表, 下一页的游标)，有序集合未初始化时返回None
+    """
+    rank_name, desc = RANK_ORDERINGS.get(sort_key, RANK_ORDERINGS["new"])
+    key = _rank_key(area_id, rank_name)
+    if not redis_store.exists(RANK_READY_KEY):
+        return None
+    # 多取一条用于判断是否还有下一页
+    count = constants.HOUSE_LIST_PAGE_CAPACITY + 1
+    if after is None:
+        if desc:
+            members = redis_store.zrevrange(key, 0, count - 1, withscores=True)
+        else:
+            members = redis_store.zrange(key, 0, count - 1, withscores=True)
+    else:
+        sort_value, last_id = after
+        result = _range_after_script(keys=[key], args=[repr(_cursor_score(sort_value)), _member(last_id),
+                                                       count, 1 if desc else 0])
+        members = [(result[i], float(result[i + 1])) for i in xrange(0, len(result), 2)]
+    next_cursor = ""
+    if len(members) > constants.HOUSE_LIST_PAGE_CAPACITY:
+        members = members[:constants.HOUSE_LIST_PAGE_CAPACITY]
+        member, score = members[-1]
+        next_cursor = pagination.encode_cursor(_cursor_value(rank_name, score), int(member))
+    return get_fragments([int(member) for member, score in members]), next_cursor
+
+
+def rebuild_house_rank():
+    """根据房屋数据重建所有有序集合，用于上线初始化或redis数据丢失后的恢复"""
+    houses = House.query.with_entities(House.id, House.area_id, House.create_time, House.order_count, House.price,
+                                       House.index_image_url)
+    pipe = redis_store.pipeline()
+    old_keys = redis_store.keys("houses_rank_*")
+    if old_keys:
+        pipe.delete(*old_keys)
+    for house in houses:
+        add_house(house, pipe=pipe)
+    pipe.set(RANK_READY_KEY, 1)
+    pipe.execute()
@@ -0,0 +1,147 @@
+# -*- coding:utf-8 -*-
+
+import json
+import time
+
+from flask import current_app
+
+from ihome import db, redis_store, constants
+from ihome.models import Order
+from ihome.utils import availability, cache, house_count, house_list_keys, house_rank
+
+
+# 订单事件队列，请求中提交订单变化后把事件放入队列，由后台进程处理缓存和排序等附带操作
+ORDER_EVENT_QUEUE = "order_events"
+
+# 重试多次仍然失败的事件放入死信队列，等待人工处理
+ORDER_EVENT_DEAD_QUEUE = "order_events_dead"
+
+# 订单事件类型
+ORDER_CREATED = "created"
+ORDER_ACCEPTED = "accepted"
+ORDER_REJECTED = "rejected"
+ORDER_COMPLETED = "completed"
+ORDER_CANCELED = "canceled"
+
+
+def _processing_key(consumer):
+    """后台进程正在处理的事件列表，进程退出时未处理完的事件在重启后放回队列"""
+    return "order_events_processing_%s" % consumer
+
+
+def publish(event, *orders):
+    """
+    订单事件在数据库提交之后发布，批量操作的多个订单作为一个事件发布，相关缓存只删除一次
+    放入队列失败时直接在请求中处理，保证附带操作不会丢失
+    """
+    if not orders:
+        return
+    order_ids = [order.id for order in orders]
+    message = json.dumps({"event": event, "order_ids": order_ids, "ts": time.time(), "attempts": 0})
+    try:
+        redis_store.lpush(ORDER_EVENT_QUEUE, message)
+    except Exception as e:
+        current_app.logger.error(e)
+        try:
+            handle(event, order_ids)
+        except Exception as e:
+            current_app.logger.error(e)
+
+
+def _on_booking_changed(orders):
+    """订单占用或释放房屋日期后，更新预订位图，每个区域只删除一次房屋总数和房屋列表页的缓存"""
+    for order in orders:
+        if order.status in availability.BLOCKING_ORDER_STATUS:
+            availability.mark_booked(order.house_id, order.begin_date, order.end_date)
+        else:
+            # 释放日期时按仍然占用房屋的订单重新计算，延迟处理的事件不会清除其他订单的日期
+            availability.release_booked(order.house_id, order.begin_date, order.end_date)
+    for area_id in set(order.house.area_id for order in orders):
+        house_count.invalidate_houses_count(area_id)
+        house_list_keys.invalidate_house_lists(area_id)
+
+
+def _on_completed(orders):
+    """
+    订单完成后房屋的成交次数和评论发生变化
+    1.按数据库中的成交次数重新写入有序集合，重复处理时结果不变
+    2.删除房屋基本信息片段、房屋评论、首页和按成交次数排序的房屋列表页缓存，房屋详情的其他信息不变
+    """
+    houses = dict((order.house_id, order.house) for order in orders)
+    for house in houses.values():
+        house_rank.add_house(house)
+        house_rank.delete_fragment(house.id)
+    cache.invalidate(constants.HOME_PAGE_DATA_REDIS_KEY, *["house_comments_%s" % house_id for house_id in houses])
+    for area_id in set(house.area_id for house in houses.values()):
+        house_list_keys.invalidate_house_lists(area_id, "booking")
+
+
+# 事件类型对应的处理函数，接单不影响缓存，没有处理函数
+_HANDLERS = {
+    ORDER_CREATED: _on_booking_changed,
+    ORDER_REJECTED: _on_booking_changed,
+    ORDER_COMPLETED: _on_completed,
+    ORDER_CANCELED: _on_booking_changed,
+}
+
+
+def handle(event, order_ids):
+    """处理一个订单事件，处理函数都按数据库中订单的当前状态执行，可以安全地重试"""
+    handler = _HANDLERS.get(event)
+    if handler is None:
+        return
+    orders = Order.query.filter(Order.id.in_(order_ids)).all()
+    if orders:
+        handler(orders)
+
+
+def _handle_message(message):
+    """处理队列中的一条事件，无法解析的事件放入死信队列，处理失败时重新放回队列，超过重试次数放入死信队列"""
+    try:
+        data = json.loads(message)
+        event, order_ids = data["event"], data["order_ids"]
+    except Exception as e:
+        current_app.logger.error(e)
+        redis_store.lpush(ORDER_EVENT_DEAD_QUEUE, json.dumps({"message": message.decode("utf-8", "replace"),
+                                                              "error": "invalid message: %s" % e}))
+        return
+    try:
+        handle(event, order_ids)
+    except Exception as e:
+        current_app.logger.error(e)
+        data["attempts"] = data.get("attempts", 0) + 1
+        data["error"] = str(e)
+        if data["attempts"] >= constants.ORDER_EVENT_MAX_RETRIES:
+            redis_store.lpush(ORDER_EVENT_DEAD_QUEUE, json.dumps(data))
+        else:
+            redis_store.lpush(ORDER_EVENT_QUEUE, json.dumps(data))
+    finally:
+        db.session.remove()
+
+
+def run_worker(consumer="default"):
+    """
+    后台处理订单事件
+    1.启动时把上次退出前未处理完的事件放回队列
+    2.使用BRPOPLPUSH取出事件的同时放入处理中列表，处理完成后再从处理中列表删除
+    3.处理失败的事件重新放回队列，超过重试次数后放入死信队列
+    4.redis等异常不退出进程，等待一段时间后把处理中列表中的事件放回队列再继续处理
+    """
+    processing_key = _processing_key(consumer)
+    recovered = False
+    while True:
+        try:
+            if not recovered:
+                while redis_store.rpoplpush(processing_key, ORDER_EVENT_QUEUE) is not None:
+                    pass
+                recovered = True
+            message = redis_store.brpoplpush(ORDER_EVENT_QUEUE, processing_key,
+                                             timeout=constants.ORDER_EVENT_BLOCK_TIMEOUT)
+            if message is None:
+                continue
+            _handle_message(message)
+            redis_store.lrem(processing_key, 1, message)
+        except Exception as e:
+            current_app.logger.error(e)
+            recovered = False
+            time.sleep(constants.WORKER_ERROR_RETRY_INTERVAL)
@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+
+import time
+
+from flask import current_app
+
+from ihome import db, redis_store, constants
+from ihome.models import Order
+from ihome.utils import order_events
+
+
+# 待接单订单的截止时间有序集合，成员为订单编号，分值为截止时间的时间戳
+ORDER_EXPIRY_KEY = "order_expiry"
+
+# 超时自动取消的订单记录的原因
+EXPIRED_COMMENT = u"房东超时未接单，订单已自动取消"
+
+# 取出并删除已到截止时间的一批订单，多个进程同时执行时每个订单只会被一个进程取出
+_pop_due_script = redis_store.register_script("""
+local ids = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+if #ids > 0 then
+    redis.call("zrem", KEYS[1], unpack(ids))
+end
+return ids
+""")
+
+
+def add_order(order_id, deadline=None):
+    """记录待接单订单的截止时间"""
+    if deadline is None:
+        deadline = time.time() + constants.ORDER_ACCEPT_EXPIRES
+    redis_store.zadd(ORDER_EXPIRY_KEY, deadline, order_id)
+
+
+def expire_due_orders(now=None):
+    """
+    取消一批已到截止时间仍未接单的订单
+    1.从有序集合中取出已到截止时间的订单，不需要扫描订单表
+    2.在一个事务中把仍处于待接单状态的订单设为已取消，已处理过的订单直接跳过
+    3.发布订单取消事件，由后台进程释放占用的日期并删除相关缓存
+    4.数据库操作失败时把取出的订单放回有序集合，下次再处理
+    :return: 本次取出的订单数
+    """
+    if now is None:
+        now = time.time()
+    order_ids = [int(order_id) for order_id in
+                 _pop_due_script(keys=[ORDER_EXPIRY_KEY], args=[now, constants.ORDER_EXPIRY_BATCH_SIZE])]
+    if not order_ids:
+        return 0
+    try:
+        orders = Order.query.filter(Order.id.in_(order_ids), Order.status == "WAIT_ACCEPT")\
+            .with_for_update().all()
+        for order in orders:
+            order.status = "CANCELED"
+            order.comment = EXPIRED_COMMENT
+            db.session.add(order)
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error(e)
+        db.session.rollback()
+        pipe = redis_store.pipeline()
+        for order_id in order_ids:
+            pipe.zadd(ORDER_EXPIRY_KEY, now, order_id)
+        pipe.execute()
+        return 0
+    order_events.publish(order_events.ORDER_CANCELED, *orders)
+    return len(order_ids)
+
+
+def run_sweeper():
+    """后台定时取消超时未接单的订单，有到期订单时连续处理，没有时等待一段时间"""
+    while True:
+        try:
+            count = expire_due_orders()
+        except Exception as e:
+            current_app.logger.error(e)
+            count = 0
+        finally:
+            db.session.remove()
+        if count < constants.ORDER_EXPIRY_BATCH_SIZE:
+            time.sleep(constants.ORDER_EXPIRY_SWEEP_INTERVAL)
+
+
+def rebuild_order_expiry():
+    """根据待接单的订单重建截止时间有序集合，用于上线初始化或redis数据丢失后的恢复"""
+    orders = Order.query.with_entities(Order.id, Order.create_time).filter(Order.status == "WAIT_ACCEPT")
+    pipe = redis_store.pipeline()
+    pipe.delete(ORDER_EXPIRY_KEY)
+    for order in orders:
+        deadline = time.mktime(order.create_time.timetuple()) + constants.ORDER_ACCEPT_EXPIRES
+        pipe.zadd(ORDER_EXPIRY_KEY, deadline, order.id)
+    pipe.execute()
@@ -0,0 +1,33 @@
+# -*- coding:utf-8 -*-
+
+import base64
+import json
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(*values):
+    """将上一页最后一条记录的排序字段值编码为不透明的游标字符串"""
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor):
+    """解码游标字符串，返回排序字段值的列表，游标不合法时抛出ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except Exception:
+        raise ValueError("invalid cursor: %r" % cursor)
+    if not isinstance(values, list):
+        raise ValueError("invalid cursor: %r" % cursor)
+    return values
+
+
+def keyset_filter(column, id_column, value, last_id, desc=True):
+    """
+    构造游标分页的过滤条件，只返回排序位置在(value, last_id)之后的记录
+    排序字段的值可能重复，所以使用主键作为第二排序字段保证顺序唯一
+    :param desc: 是否为降序排序，主键与排序字段使用相同的排序方向
+    """
+    if desc:
+        return or_(column < value, and_(column == value, id_column < last_id))
+    return or_(column > value, and_(column == value, id_column > last_id))
@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+
+import datetime
+
+import numpy as np
+
+from ihome import db, constants
+from ihome.models import HousePriceCalendar
+
+
+# 价格日历数组的存储格式，小端int32，单位：分
+_PRICE_DTYPE = np.dtype("<i4")
+
+# 周六、周日对应的weekday()
+_WEEKEND_DAYS = (5, 6)
+
+
+def build_prices(start_date, weekend_price=None, overrides=()):
+    """
+    构造从起始日期开始的价格数组，数组中0表示当天使用房屋单价
+    :param weekend_price: 周末价格，为空表示周末使用房屋单价
+    :param overrides: 季节价格[(开始日期, 结束日期, 价格)]，包含结束日期，后面的设置覆盖前面的设置和周末价格
+    """
+    prices = np.zeros(constants.HOUSE_PRICE_CALENDAR_DAYS, dtype=_PRICE_DTYPE)
+    if weekend_price:
+        weekdays = (np.arange(constants.HOUSE_PRICE_CALENDAR_DAYS) + start_date.weekday()) % 7
+        prices[np.in1d(weekdays, _WEEKEND_DAYS)] = weekend_price
+    for begin, end, price in overrides:
+        lo = max((begin - start_date).days, 0)
+        hi = min((end - start_date).days + 1, constants.HOUSE_PRICE_CALENDAR_DAYS)
+        if lo < hi:
+            prices[lo:hi] = price
+    return prices
+
+
+def save_calendar(house_id, start_date, prices):
+    """保存房屋的价格日历，需要调用方提交事务"""
+    calendar = HousePriceCalendar.query.get(house_id)
+    if calendar is None:
+        calendar = HousePriceCalendar(house_id=house_id)
+    calendar.start_date = start_date
+    calendar.prices = prices.astype(_PRICE_DTYPE).tobytes()
+    db.session.add(calendar)
+
+
+def quote(houses, start_date, end_date):
+    """
+    计算多套房屋在日期范围内的总价，包含结束日期
+    1.所有房屋的每日价格组成一个二维数组，默认填充房屋单价
+    2.有价格日历的房屋用日历中与日期范围重叠的部分覆盖，日历中为0的日期仍使用房屋单价
+    3.按行求和得到每套房屋的总价
+    :param houses: 房屋对象列表，需要加载id和price
+    :return: 与houses顺序一致的总价数组，单位：分
+    """
+    if isinstance(start_date, datetime.datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime.datetime):
+        end_date = end_date.date()
+    base = np.array([house.price or 0 for house in houses], dtype=np.int64)
+    if not houses:
+        return base
+    days = (end_date - start_date).days + 1
+    prices = np.repeat(base[:, np.newaxis], days, axis=1)
+    calendars = HousePriceCalendar.query.filter(
+        HousePriceCalendar.house_id.in_([house.id for house in houses])).all()
+    calendars = dict((calendar.house_id, calendar) for calendar in calendars)
+    for row, house in enumerate(houses):
+        calendar = calendars.get(house.id)
+        if calendar is None:
+            continue
+        values = np.frombuffer(calendar.prices, dtype=_PRICE_DTYPE)
+        # 查询的起始日期在价格日历中的位置
+        offset = (start_date - calendar.start_date).days
+        lo = max(offset, 0)
+        hi = min(offset + days, len(values))
+        if lo >= hi:
+            continue
+        window = values[lo:hi]
+        prices[row, lo - offset:hi - offset] = np.where(window > 0, window, base[row])
+    return prices.sum(axis=1)
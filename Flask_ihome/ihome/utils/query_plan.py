@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+
+import datetime
+
+from sqlalchemy import func
+
+from ihome import db, constants
+from ihome.models import House, Order, User
+from ihome.utils import availability, pagination
+
+
+# EXPLAIN结果中表示全表扫描的访问类型，出现时说明查询没有用到索引
+_FULL_SCAN_TYPE = "ALL"
+
+# EXPLAIN结果Extra列中需要关注的内容
+_EXTRA_WARNINGS = ("Using filesort", "Using temporary")
+
+
+def _sample_values():
+    """从数据库中取出各查询使用的参数值，数据库没有数据时使用默认值"""
+    house = House.query.with_entities(House.id, House.area_id, House.user_id).order_by(House.id).first()
+    order = Order.query.with_entities(Order.id, Order.user_id, Order.begin_date, Order.end_date, Order.update_time)\
+        .order_by(Order.id).first()
+    mobile = db.session.query(func.min(User.mobile)).scalar()
+    today = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        "house_id": house.id if house else 1,
+        "area_id": house.area_id if house else 1,
+        "landlord_id": house.user_id if house else 1,
+        "user_id": order.user_id if order else 1,
+        "begin_date": order.begin_date if order else today,
+        "end_date": order.end_date if order else today,
+        "mobile": mobile or "13800000000",
+        "order_id": order.id if order else 1,
+        "update_time": order.update_time if order else today,
+    }
+
+
+def _query_shapes(values):
+    """
+    各接口的热点查询，尽量使用视图函数中构造查询的同一个方法，与视图函数中的查询条件和排序方式保持一致
+    :return: [(查询名称, 查询对象)]
+    """
+    shapes = [
+        # 下单时检查预订日期冲突的订单
+        ("order_conflict", availability.conflict_orders_query(values["begin_date"], values["end_date"],
+                                                              house_id=values["house_id"])),
+        # 房屋详情页和评论接口查询房屋评论的第一页和游标之后的一页
+        ("house_comments", Order.comments_query(values["house_id"])
+            .limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS + 1)),
+        ("house_comments_cursor", Order.comments_query(values["house_id"])
+            .filter(pagination.keyset_filter(Order.update_time, Order.id, values["update_time"], values["order_id"]))
+            .limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS + 1)),
+        # 房客查询自己的订单
+        ("user_orders", Order.query.join(Order.house).options(*Order.list_query_options())
+            .filter(Order.user_id == values["user_id"])
+            .order_by(Order.create_time.desc(), Order.id.desc())
+            .limit(constants.ORDER_LIST_PAGE_CAPACITY + 1)),
+        # 房东查询自己房屋的订单
+        ("landlord_orders", Order.query.join(Order.house).options(*Order.list_query_options())
+            .filter(House.user_id == values["landlord_id"])
+            .order_by(Order.create_time.desc(), Order.id.desc())
+            .limit(constants.ORDER_LIST_PAGE_CAPACITY + 1)),
+        # 用户登录时按手机号查询用户
+        ("user_login", User.query.filter_by(mobile=values["mobile"])),
+    ]
+    # 房屋列表页按区域筛选后的各种排序方式
+    for name, column in (("new", House.create_time), ("booking", House.order_count), ("price", House.price)):
+        shapes.append(("houses_%s" % name, House.query.options(*House.basic_query_options())
+                       .filter(House.area_id == values["area_id"])
+                       .order_by(column.desc(), House.id.desc())
+                       .limit(constants.HOUSE_LIST_PAGE_CAPACITY)))
+    # 预订位图不可用时，房屋列表页按日期筛选退回到订单表子查询
+    conflict_orders = availability.conflict_orders_query(values["begin_date"], values["end_date"])
+    shapes.append(("houses_date_fallback", House.query.options(*House.basic_query_options())
+                   .filter(House.area_id == values["area_id"], House.id.notin_(conflict_orders.subquery()))
+                   .order_by(House.create_time.desc(), House.id.desc())
+                   .limit(constants.HOUSE_LIST_PAGE_CAPACITY)))
+    return shapes
+
+
+def _explain(connection, query):
+    """对查询执行EXPLAIN，返回以列名为键的字典列表"""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    cursor = connection.cursor()
+    try:
+        params = compiled.params
+        # MySQLdb使用%s位置参数，需要按占位符的顺序传入参数列表
+        if compiled.positional:
+            params = [params[name] for name in compiled.positiontup]
+        cursor.execute("EXPLAIN " + str(compiled), params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def explain_queries():
+    """
+    对各接口的热点查询执行EXPLAIN，检查是否用到了索引
+    1.从数据库中取出查询参数，使用填充了测试数据的数据库时结果才有参考意义
+    2.逐个查询输出执行计划中的表、访问类型、使用的索引、扫描行数和Extra
+    3.出现全表扫描的查询记为问题，出现文件排序或临时表的查询只给出提示
+    :return: 出现全表扫描的查询名称列表
+    """
+    problems = []
+    connection = db.engine.raw_connection()
+    try:
+        for name, query in _query_shapes(_sample_values()):
+            print name
+            for row in _explain(connection, query):
+                extra = row.get("Extra") or ""
+                print "    table=%s type=%s key=%s rows=%s extra=%s" % (
+                    row.get("table"), row.get("type"), row.get("key"), row.get("rows"), extra)
+                if row.get("type") == _FULL_SCAN_TYPE:
+                    if name not in problems:
+                        problems.append(name)
+                    print "    [问题] 全表扫描：%s" % row.get("table")
+                for warning in _EXTRA_WARNINGS:
+                    if warning in extra:
+                        print "    [提示] %s：%s" % (warning, row.get("table"))
+    finally:
+        connection.close()
+    return problems
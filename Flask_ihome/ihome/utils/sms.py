@@ -70,6 +70,17 @@ class CCP(object):
             return -1
 
 
+class StubSMS(object):
+    """不发送真实短信的本地网关，用于开发和测试，发送的短信保存在sent中"""
+
+    sent = []
+
+    def send_template_sms(self, to, datas, temp_id):
+        """记录模板短信，始终返回0表示发送成功"""
+        StubSMS.sent.append({"to": to, "datas": datas, "temp_id": temp_id})
+        return 0
+
+
 if __name__ == '__main__':
     ccp = CCP()
     # 注意： 测试的短信模板编号为1
@@ -0,0 +1,153 @@
+# -*- coding:utf-8 -*-
+
+import json
+import time
+
+from flask import current_app
+
+from ihome import redis_store, constants
+from ihome.utils import sms
+
+
+# 短信发送队列，请求中保存验证码后把发送任务放入队列，由后台进程调用短信网关发送
+SMS_QUEUE = "sms_queue"
+
+# 发送失败等待重试的任务，分值为下次重试的时间
+SMS_RETRY_KEY = "sms_retry"
+
+# 重试多次仍然失败、验证码已经过期或已被替换的任务放入死信队列，等待人工处理，不保存验证码
+SMS_DEAD_QUEUE = "sms_dead"
+
+# 把到期的重试任务放回发送队列，多个后台进程同时执行时每个任务只会被放回一次
+_requeue_due_script = redis_store.register_script("""
+local jobs = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #jobs > 0 then
+    redis.call('zrem', KEYS[1], unpack(jobs))
+    redis.call('lpush', KEYS[2], unpack(jobs))
+end
+return #jobs
+""")
+
+
+def _processing_key(consumer):
+    """后台进程正在发送的任务列表，进程退出时未发送完的任务在重启后放回队列"""
+    return "sms_processing_%s" % consumer
+
+
+def get_gateway():
+    """根据配置SMS_GATEWAY获取短信网关，stub为不发送真实短信的本地网关"""
+    if current_app.config.get("SMS_GATEWAY") == "stub":
+        return sms.StubSMS()
+    return sms.CCP()
+
+
+def send_sms_code(mobile, sms_code):
+    """
+    发送短信验证码，放入队列后立即返回
+    放入队列失败时直接在请求中发送
+    :return: 0 表示已放入队列或发送成功，-1 表示发送失败
+    """
+    message = json.dumps({"mobile": mobile, "sms_code": sms_code, "ts": time.time(), "attempts": 0})
+    try:
+        redis_store.lpush(SMS_QUEUE, message)
+    except Exception as e:
+        current_app.logger.error(e)
+        return get_gateway().send_template_sms(mobile, [sms_code, constants.SMS_CODE_REDIS_EXPIRES/60], 1)
+    return 0
+
+
+def _send(data):
+    """调用短信网关发送一条验证码短信，网关返回失败时抛出异常"""
+    result = get_gateway().send_template_sms(data["mobile"], [data["sms_code"], constants.SMS_CODE_REDIS_EXPIRES/60], 1)
+    if result != 0:
+        raise RuntimeError("sms gateway returned %s" % result)
+
+
+def _dead_letter(data, error):
+    """把任务放入死信队列，不保存验证码，死信队列只保留最近的一部分任务"""
+    data.pop("sms_code", None)
+    data["error"] = error
+    pipe = redis_store.pipeline()
+    pipe.lpush(SMS_DEAD_QUEUE, json.dumps(data))
+    pipe.ltrim(SMS_DEAD_QUEUE, 0, constants.SMS_DEAD_QUEUE_MAX_SIZE - 1)
+    pipe.execute()
+
+
+def _handle_message(message):
+    """
+    发送队列中的一条任务
+    1.验证码已经过期，或用户已经重新获取了验证码的任务不再发送，放入死信队列
+    2.发送失败时按重试次数指数退避，放入重试集合等待下次发送
+    3.超过重试次数放入死信队列
+    4.无法解析的任务放入死信队列，不保存原始内容，避免死信队列中出现验证码
+    """
+    try:
+        data = json.loads(message)
+        if not all(key in data for key in ("mobile", "sms_code", "ts")):
+            raise ValueError("missing fields")
+    except Exception as e:
+        current_app.logger.error(e)
+        _dead_letter({"ts": time.time()}, "invalid message: %s" % e)
+        return
+    if time.time() - data["ts"] >= constants.SMS_CODE_REDIS_EXPIRES:
+        _dead_letter(data, "sms code expired")
+        return
+    # 重试期间用户重新获取了验证码时，旧验证码已经失效，不再发送
+    real_sms_code = redis_store.get("SMSCode_" + data["mobile"])
+    if real_sms_code != data["sms_code"]:
+        _dead_letter(data, "sms code replaced")
+        return
+    try:
+        _send(data)
+    except Exception as e:
+        current_app.logger.error(e)
+        data["attempts"] = data.get("attempts", 0) + 1
+        if data["attempts"] >= constants.SMS_SEND_MAX_RETRIES:
+            _dead_letter(data, str(e))
+        else:
+            data["error"] = str(e)
+            delay = constants.SMS_RETRY_BASE_DELAY * 2 ** (data["attempts"] - 1)
+            redis_store.zadd(SMS_RETRY_KEY, time.time() + delay, json.dumps(data))
+
+
+def requeue_due_retries():
+    """把到期的重试任务放回发送队列，返回放回的数量"""
+    return _requeue_due_script(keys=[SMS_RETRY_KEY, SMS_QUEUE], args=[time.time(), constants.SMS_RETRY_BATCH_SIZE])
+
+
+def run_worker(consumer="default"):
+    """
+    后台发送短信
+    1.启动时把上次退出前未发送完的任务放回队列
+    2.每次等待前把到期的重试任务放回队列，等待超时时间不超过重试的最小间隔
+    3.使用BRPOPLPUSH取出任务的同时放入处理中列表，处理完成后再从处理中列表删除
+    4.redis等异常不退出进程，等待一段时间后把处理中列表中的任务放回队列再继续处理
+    """
+    processing_key = _processing_key(consumer)
+    recovered = False
+    while True:
+        try:
+            if not recovered:
+                while redis_store.rpoplpush(processing_key, SMS_QUEUE) is not None:
+                    pass
+                recovered = True
+            requeue_due_retries()
+            message = redis_store.brpoplpush(SMS_QUEUE, processing_key, timeout=constants.SMS_QUEUE_BLOCK_TIMEOUT)
+            if message is None:
+                continue
+            _handle_message(message)
+            redis_store.lrem(processing_key, 1, message)
+        except Exception as e:
+            current_app.logger.error(e)
+            recovered = False
+            time.sleep(constants.WORKER_ERROR_RETRY_INTERVAL)
+
+
+def queue_stats():
+    """获取发送队列、重试集合和死信队列中的任务数量"""
+    pipe = redis_store.pipeline()
+    pipe.llen(SMS_QUEUE)
+    pipe.zcard(SMS_RETRY_KEY)
+    pipe.llen(SMS_DEAD_QUEUE)
+    queued, retrying, dead = pipe.execute()
+    return {"queued": queued, "retrying": retrying, "dead": dead}
@@ -0,0 +1,114 @@
+# -*- coding:utf-8 -*-
+
+import json
+import re
+import threading
+import urllib
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+from ihome import redis_store, constants
+from ihome.utils import cache
+from ihome.utils.response_code import RET
+
+
+# 缓存预热锁，多个进程同时启动时只有一个进程执行预热
+WARMUP_LOCK_KEY = "cache_warmup_lock"
+
+# 每次都需要预热的缓存对应的接口
+_ALWAYS_WARM_URLS = ("/api/v1.0/areas", "/api/v1.0/houses/index")
+
+_HOUSE_INFO_RE = re.compile(r"^house_info_(\d+)$")
+_HOUSE_COMMENTS_RE = re.compile(r"^house_comments_(\d+)$")
+# 房屋列表页缓存的键为houses_<区域>_<开始日期>_<结束日期>_<排序方式>
+_HOUSE_LIST_RE = re.compile(r"^houses_([^_]*)_([^_]*)_([^_]*)_([^_]*)$")
+
+
+def _key_url(key, field):
+    """根据缓存的键和字段得到重建该缓存的接口地址，不是接口缓存时返回None"""
+    match = _HOUSE_INFO_RE.match(key)
+    if match:
+        return "/api/v1.0/houses/%s" % match.group(1)
+    match = _HOUSE_COMMENTS_RE.match(key)
+    if match:
+        return "/api/v1.0/houses/%s/comments" % match.group(1)
+    match = _HOUSE_LIST_RE.match(key)
+    if match and field:
+        params = dict(zip(("aid", "sd", "ed", "sk"), match.groups()))
+        if field.startswith("cursor_"):
+            params["cursor"] = field[len("cursor_"):]
+        else:
+            params["p"] = field
+        return "/api/v1.0/houses?%s" % urllib.urlencode(params)
+    return None
+
+
+def warmup_urls(limit=None):
+    """需要预热的接口地址，包括城区信息、首页和访问次数最多的房屋详情、房屋列表页"""
+    if limit is None:
+        limit = constants.CACHE_WARMUP_TOP_KEYS
+    urls = list(_ALWAYS_WARM_URLS)
+    for key, field in cache.hot_keys(limit):
+        url = _key_url(key, field)
+        if url is not None and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def warm_up(limit=None, workers=None):
+    """
+    预热缓存
+    1.根据访问次数统计得到需要预热的接口
+    2.使用有限的并发数请求这些接口，接口在缓存未命中时重建并写入缓存，同一缓存只会被重建一次
+    :return: (成功的请求数, 失败的请求数)
+    """
+    if workers is None:
+        workers = constants.CACHE_WARMUP_WORKERS
+    app = current_app._get_current_object()
+    urls = warmup_urls(limit)
+
+    def fetch(url):
+        response = app.test_client().get(url)
+        if response.status_code not in (200, 304):
+            app.logger.error("warm up %s failed: %s" % (url, response.status_code))
+            return False
+        # 接口出错时也返回200，需要检查响应中的errno，出错的接口不会写入缓存
+        if response.status_code == 200:
+            try:
+                errno = json.loads(response.get_data()).get("errno")
+            except Exception as e:
+                app.logger.error("warm up %s failed: %s" % (url, e))
+                return False
+            if str(errno) != RET.OK:
+                app.logger.error("warm up %s failed: errno %s" % (url, errno))
+                return False
+        return True
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        results = list(executor.map(fetch, urls))
+    finally:
+        executor.shutdown()
+    succeeded = sum(1 for result in results if result)
+    return succeeded, len(results) - succeeded
+
+
+def _warm_up_once(app):
+    """抢到预热锁的进程执行预热"""
+    with app.app_context():
+        try:
+            # 锁不主动释放，有效期内其他进程启动时不再重复预热
+            if not redis_store.set(WARMUP_LOCK_KEY, 1, nx=True, ex=constants.CACHE_WARMUP_LOCK_EXPIRES):
+                return
+            succeeded, failed = warm_up()
+            current_app.logger.info("cache warm up finished, succeeded: %s, failed: %s" % (succeeded, failed))
+        except Exception as e:
+            current_app.logger.error(e)
+
+
+def start_background_warmup(app):
+    """应用启动时在后台线程中预热缓存，不阻塞应用启动"""
+    thread = threading.Thread(target=_warm_up_once, args=(app,))
+    thread.daemon = True
+    thread.start()
@@ -2,10 +2,13 @@
 # coding=utf-8
 
 # 项目启动文件
+import time
+
 from ihome import create_app,db
 from flask_script import Manager
 from flask_migrate import Migrate,MigrateCommand
 from ihome import models
+from ihome.utils import availability, cache, house_rank, query_plan, order_events, order_expiry, warmup, captcha_pool, sms_queue
 
 
 app = create_app('development')
@@ -14,6 +17,100 @@ Migrate(app,db)
 manager = Manager(app)
 manager.add_command("db",MigrateCommand)
 
+
+@manager.command
+def rebuild_availability():
+    """根据订单数据重建房屋的预订位图"""
+    availability.rebuild_booked_index()
+
+
+@manager.command
+def rebuild_house_rank():
+    """根据房屋数据重建房屋列表页的有序集合"""
+    house_rank.rebuild_house_rank()
+
+
+@manager.command
+def rebuild_order_expiry():
+    """根据待接单的订单重建接单截止时间的有序集合"""
+    order_expiry.rebuild_order_expiry()
+
+
+@manager.option('-l', '--limit', dest='limit', type=int, default=None, help=u'预热的热点缓存数量')
+@manager.option('-w', '--workers', dest='workers', type=int, default=None, help=u'预热的并发请求数')
+def warm_cache(limit, workers):
+    """预热城区信息、首页和访问次数最多的房屋详情、房屋列表页缓存"""
+    succeeded, failed = warmup.warm_up(limit, workers)
+    print "预热完成，成功：%s，失败：%s" % (succeeded, failed)
+
+
+@manager.command
+def explain_queries():
+    """对各接口的热点查询执行EXPLAIN，出现全表扫描时以非0状态退出"""
+    problems = query_plan.explain_queries()
+    if problems:
+        print "以下查询出现全表扫描：%s" % ", ".join(problems)
+        return 1
+
+
+@manager.option('-n', '--name', dest='name', default='default', help=u'后台进程的名称，多个进程需要使用不同的名称')
+def order_event_worker(name):
+    """处理订单事件队列，更新预订位图、房屋排序和相关缓存"""
+    order_events.run_worker(name)
+
+
+@manager.command
+def order_expiry_sweeper():
+    """定时取消超时未接单的订单"""
+    order_expiry.run_sweeper()
+
+
+@manager.command
+def captcha_producer():
+    """后台预先生成图片验证码，补充验证码池"""
+    captcha_pool.run_producer()
+
+
+@manager.option('-i', '--interval', dest='interval', type=int, default=10, help=u'统计生成和请求速率的时间间隔，单位：秒')
+def captcha_pool_stats(interval):
+    """输出图片验证码池的数量，以及一段时间内的生成和请求速率"""
+    before = captcha_pool.pool_stats()
+    time.sleep(interval)
+    after = captcha_pool.pool_stats()
+    print "数量：%s，池空次数：%s" % (after["depth"], after["empty"])
+    print "生成速率：%.1f/秒，请求速率：%.1f/秒" % (
+        float(after["produced"] - before["produced"]) / interval,
+        float(after["requested"] - before["requested"]) / interval)
+
+
+
+@manager.option('-n', '--name', dest='name', default='default', help=u'后台进程的名称，多个进程需要使用不同的名称')
+def sms_worker(name):
+    """处理短信发送队列，发送失败时重试"""
+    sms_queue.run_worker(name)
+
+
+@manager.command
+def sms_queue_stats():
+    """输出短信发送队列、重试和死信队列中的任务数量"""
+    stats = sms_queue.queue_stats()
+    print "待发送：%s，等待重试：%s，死信：%s" % (stats["queued"], stats["retrying"], stats["dead"])
+
+
+
+@manager.option('-i', '--interval', dest='interval', type=int, default=60, help=u'统计命中率的时间间隔，单位：秒')
+def cache_stats(interval):
+    """输出所有进程一段时间内进程内缓存和redis缓存的命中次数和命中率"""
+    before = cache.cluster_stats()
+    time.sleep(interval)
+    after = cache.cluster_stats()
+    for layer in ("local", "redis"):
+        hits = after[layer + "_hit"] - before[layer + "_hit"]
+        misses = after[layer + "_miss"] - before[layer + "_miss"]
+        rate = 100.0 * hits / (hits + misses) if hits + misses else 0
+        print "%s：命中 %s，未命中 %s，命中率 %.1f%%" % (layer, hits, misses, rate)
+
+
 if __name__ == '__main__':
     print app.url_map
     manager.run()
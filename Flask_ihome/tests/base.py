@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+
+import unittest
+
+from config import Config
+from ihome import create_app, db, redis_store
+from ihome.models import Area, House, User
+
+
+class BaseTestCase(unittest.TestCase):
+    """测试基类，每个测试重新创建测试数据库中的表并清空测试使用的redis库，mysql或redis不可用时跳过测试"""
+
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        # 测试前后会清空测试使用的redis库，不能与开发库相同
+        self.assertNotEqual(self.app.config["REDIS_DB"], Config.REDIS_DB)
+        try:
+            redis_store.flushdb()
+            db.drop_all()
+            db.create_all()
+        except Exception as e:
+            self.app_context.pop()
+            raise unittest.SkipTest("测试数据库不可用：%s" % e)
+        self.area = Area(name=u"测试区域")
+        db.session.add(self.area)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        redis_store.flushdb()
+        self.app_context.pop()
+
+    def create_user(self, mobile, **kwargs):
+        """创建用户，需要调用方提交事务"""
+        user = User(name=mobile, mobile=mobile, **kwargs)
+        user.password = "123456"
+        db.session.add(user)
+        return user
+
+    def create_house(self, user, **kwargs):
+        """创建房屋，需要调用方提交事务"""
+        house = House(user=user, area=self.area, title=u"测试房屋", price=10000, **kwargs)
+        db.session.add(house)
+        return house
+
+    def login(self, client, user_id):
+        """在测试客户端的session中保存登录用户"""
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
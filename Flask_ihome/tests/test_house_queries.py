@@ -0,0 +1,50 @@
+# -*- coding:utf-8 -*-
+
+import unittest
+
+from sqlalchemy import event
+
+from ihome import db
+from ihome.models import House
+from tests.base import BaseTestCase
+
+
+class HouseBasicQueryTest(BaseTestCase):
+    """房屋列表使用basic_query_options加载时，查询次数不随房屋数量增长"""
+
+    HOUSE_COUNT = 20
+
+    def setUp(self):
+        super(HouseBasicQueryTest, self).setUp()
+        # 每套房屋属于不同的房东，懒加载房东信息时每套房屋都会多一次查询
+        for i in xrange(self.HOUSE_COUNT):
+            self.create_house(self.create_user("138%08d" % i, avatar_url="avatar_%s" % i))
+        db.session.commit()
+
+    def count_queries(self, limit):
+        """查询一页房屋并转换为基本信息，返回执行的sql语句数"""
+        # 清空session，关联对象不会从session中直接取得
+        db.session.remove()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            houses = House.query.options(*House.basic_query_options()).order_by(House.id).limit(limit).all()
+            houses_dict_list = [house.to_basic_dict() for house in houses]
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(len(houses_dict_list), limit)
+        return len(statements)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        small_page = self.count_queries(2)
+        large_page = self.count_queries(self.HOUSE_COUNT)
+        self.assertEqual(small_page, large_page)
+        self.assertEqual(large_page, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
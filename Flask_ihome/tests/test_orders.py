@@ -0,0 +1,62 @@
+# -*- coding:utf-8 -*-
+
+import datetime
+import json
+import threading
+import unittest
+
+from ihome import db
+from ihome.models import Order
+from ihome.utils.response_code import RET
+from tests.base import BaseTestCase
+
+
+class SaveOrderConcurrencyTest(BaseTestCase):
+    """同一房屋同一日期的并发下单，房屋记录加锁后只有一个请求能够成功"""
+
+    # 同时下单的用户数，超过连接池大小时部分请求等待数据库连接
+    THREAD_COUNT = 20
+
+    def test_concurrent_orders_for_one_house(self):
+        landlord = self.create_user("13800000000")
+        house = self.create_house(landlord)
+        guests = [self.create_user("139%08d" % i) for i in xrange(self.THREAD_COUNT)]
+        db.session.commit()
+        house_id = house.id
+        guest_ids = [guest.id for guest in guests]
+        db.session.remove()
+
+        start_date = datetime.date.today() + datetime.timedelta(days=1)
+        order_data = json.dumps({
+            "house_id": house_id,
+            "start_date": start_date.strftime("%Y-%m-%d"),
+            "end_date": (start_date + datetime.timedelta(days=2)).strftime("%Y-%m-%d"),
+        })
+        # 所有线程登录完成后同时发出请求
+        ready = threading.Event()
+        results = []
+        results_lock = threading.Lock()
+
+        def book(guest_id):
+            client = self.app.test_client()
+            self.login(client, guest_id)
+            ready.wait()
+            response = client.post("/api/v1.0/orders", data=order_data, content_type="application/json")
+            with results_lock:
+                results.append(json.loads(response.data)["errno"])
+
+        threads = [threading.Thread(target=book, args=(guest_id,)) for guest_id in guest_ids]
+        for thread in threads:
+            thread.start()
+        ready.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.THREAD_COUNT)
+        self.assertEqual(results.count(RET.OK), 1)
+        self.assertEqual(results.count(RET.DATAERR), self.THREAD_COUNT - 1)
+        self.assertEqual(Order.query.filter_by(house_id=house_id).count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()